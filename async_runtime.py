@@ -0,0 +1,197 @@
+# optional asyncio runtime on asyncpraw, used when config.json has "runtime": "async"
+#
+# the stream, parent and submission fetches and outbound actions are
+# coroutines, so one slow request never holds up the rest. Comment handling is
+# the same Bot code as the threaded runtime: what a comment's handlers will
+# read is fetched up front (see handler_prefetch), then the handlers run with
+# everything already loaded. The synchronous parts (checkpoint and outbound
+# queue writes to SQLite, the handlers) run on worker threads so they never
+# block the event loop. asyncpraw is only needed in this mode
+import asyncio, json, logging, time, traceback, zlib
+import aiohttp, asyncpraw, asyncprawcore
+from bot import handler_prefetch
+from outbound import ActionQueue
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# the persisted outbound queue, sent from the event loop with asyncpraw
+class AsyncActionQueue(ActionQueue):
+  api_exception = asyncpraw.exceptions.RedditAPIException
+  gone_exceptions = (asyncprawcore.exceptions.Forbidden, asyncprawcore.exceptions.NotFound)
+  rejected_exceptions = (asyncpraw.exceptions.RedditAPIException, asyncprawcore.exceptions.TooManyRequests)
+  request_exception = asyncprawcore.exceptions.RequestException
+  connect_exceptions = (aiohttp.ClientConnectorError,)
+
+  def __init__(self, path, rate=0.5, burst=5, reserve=10, max_attempts=5, backoff=30):
+    # the asyncpraw client only exists once the event loop runs, see run()
+    super().__init__(None, path, rate, burst, reserve, max_attempts, backoff, start=False)
+    self.loop = None
+    self.async_wake = None
+
+  def _add(self, kind, target, payload):
+    super()._add(kind, target, payload)
+    # may be called from catch-up, which runs on a worker thread
+    if self.loop:
+      self.loop.call_soon_threadsafe(self.async_wake.set)
+
+  async def run(self, reddit):
+    self.reddit = reddit
+    self.loop = asyncio.get_running_loop()
+    self.async_wake = asyncio.Event()
+    while True:
+      action, delay = self._next_ready()
+      if not action or delay > 0:
+        try:
+          await asyncio.wait_for(self.async_wake.wait(), delay)
+        except asyncio.TimeoutError:
+          pass
+        self.async_wake.clear()
+        continue
+
+      action_id, kind, target, payload, attempts, not_before = action
+      self.tokens -= 1
+      self.sending_id = action_id
+      start = time.perf_counter()
+      try:
+        await self._send_async(action_id, kind, target, json.loads(payload))
+      except Exception as e:
+        self._retry(action_id, kind, target, attempts, e)
+        continue
+      finally:
+        self.sending_id = None
+        metrics.observe("bot_reddit_api_seconds", time.perf_counter() - start, kind=kind)
+
+      self._remove(action_id)
+
+  async def _send_async(self, action_id, kind, target, payload):
+    logger.debug(f"Sending {kind} for {target}")
+    if kind == "reply":
+      comment = await self.reddit.comment(target, fetch=False)
+      await comment.reply(payload["text"])
+    elif kind == "submission_reply":
+      submission = await self.reddit.submission(target, fetch=False)
+      new_comment = await submission.reply(payload["text"])
+      if payload["sticky"]:
+        self._convert_to_sticky(action_id, new_comment.id)
+        await new_comment.mod.distinguish(sticky=True)
+    elif kind == "sticky":
+      comment = await self.reddit.comment(target, fetch=False)
+      await comment.mod.distinguish(sticky=True)
+    elif kind == "flair":
+      submission = await self.reddit.submission(target, fetch=False)
+      await submission.flair.select(payload["template_id"])
+    else:
+      logger.error(f"Unknown outbound action {kind}, dropping it")
+
+# the asyncio version of CommentPipeline: comments are routed to a fixed
+# number of worker tasks by submission, so each thread is handled in order
+class AsyncCommentPipeline:
+  def __init__(self, handler, workers=4, queue_size=100):
+    self.handler = handler
+    self.workers = workers
+    self.queues = [asyncio.Queue(maxsize=queue_size) for _ in range(workers)]
+    self.tasks = [asyncio.create_task(self._worker(worker_id)) for worker_id in range(workers)]
+    logger.info(f"Async comment pipeline started with {workers} workers and queue size {queue_size}")
+
+  # queue a comment for processing, waits while that worker's queue is full
+  async def submit(self, comment, key):
+    await self.queues[zlib.crc32(key.encode()) % self.workers].put(comment)
+
+  async def _worker(self, worker_id):
+    comments = self.queues[worker_id]
+    while True:
+      comment = await comments.get()
+      try:
+        await self.handler(comment)
+      except Exception as e:
+        metrics.inc("bot_exceptions_total", type=type(e).__name__)
+        logger.error(f"Async worker {worker_id} encountered an exception: {e}")
+        traceback.print_exc()
+      finally:
+        comments.task_done()
+
+async def _load(ctx, obj):
+  if not getattr(obj, "_fetched", True):
+    start = time.perf_counter()
+    await obj.load()
+    ctx.record_call()
+    metrics.observe("bot_reddit_api_seconds", time.perf_counter() - start, kind=f"fetch_{type(obj).__name__.lower()}")
+
+async def _load_parent(ctx):
+  parent = await ctx.comment.parent()
+  await _load(ctx, parent)
+  ctx.parent = parent
+
+# fetch what the handlers need, concurrently, so they never block on Reddit
+async def prefetch(ctx, needs):
+  loads = []
+  if "submission" in needs or ("parent" in needs and ctx.parent_is_submission):
+    info = ctx.submission_cache.get(ctx.submission.id) if ctx.submission_cache else None
+    if info:
+      ctx.submission_info = info
+    else:
+      loads.append(_load(ctx, ctx.submission))
+  if "parent" in needs:
+    if ctx.parent_is_submission:
+      ctx.parent = ctx.submission
+    else:
+      loads.append(_load_parent(ctx))
+  await asyncio.gather(*loads)
+
+async def handle_comment(bot, comment, retry_delay):
+  try:
+    ctx = await asyncio.to_thread(bot.begin_comment, comment)
+    if not ctx:
+      return
+    handlers = bot.handlers_for(ctx)
+    try:
+      await prefetch(ctx, {need for handler in handlers for need in handler_prefetch[handler]})
+      await asyncio.to_thread(bot.run_handlers, ctx, handlers)
+    except Exception:
+      await asyncio.to_thread(bot.record_failure, comment)
+      raise
+  except asyncpraw.exceptions.RedditAPIException as e:
+    metrics.inc("bot_exceptions_total", type=type(e).__name__)
+    logger.error(f"Encountered an API exception: {e}")
+    await asyncio.sleep(retry_delay)
+
+# Bot.start_retrying_failed for the event loop, retried through the sync client on a thread like catch-up
+async def retry_failed_comments(bot):
+  while bot.failed_retry_interval > 0:
+    await asyncio.sleep(bot.failed_retry_interval)
+    try:
+      await asyncio.to_thread(bot.retry_failed)
+    except Exception as e:
+      logger.error(f"Error retrying failed comments: {e}")
+      traceback.print_exc()
+
+# run the bot until interrupted. bot.actions must be an AsyncActionQueue
+async def run_async(bot, reddit_settings, workers=4, queue_size=100, retry_delay=10, heartbeat=None):
+  async with asyncpraw.Reddit(**reddit_settings) as reddit:
+    # kept so the task isn't garbage collected
+    outbound = asyncio.create_task(bot.actions.run(reddit))
+    beating = asyncio.create_task(heartbeat.run()) if heartbeat and heartbeat.path else None
+    retrying = asyncio.create_task(retry_failed_comments(bot))
+    pipeline = AsyncCommentPipeline(lambda comment: handle_comment(bot, comment, retry_delay), workers, queue_size)
+    subreddit = await reddit.subreddit(bot.subreddit_names)
+
+    while True:
+      try:
+        # catch-up goes through the sync client on a thread, before the stream starts
+        since = await asyncio.to_thread(bot.catch_up)
+        # the stream's first page overlaps with catch-up, already handled comments are skipped
+        async for comment in subreddit.stream.comments(skip_existing=since is None):
+          # should_dispatch may save the checkpoint
+          if await asyncio.to_thread(bot.should_dispatch, comment, since):
+            # link_id is part of the streamed data, so this doesn't fetch the submission
+            await pipeline.submit(comment, comment.link_id)
+      except asyncpraw.exceptions.RedditAPIException as e:
+        metrics.inc("bot_exceptions_total", type=type(e).__name__)
+        logger.error(f"Encountered an API exception: {e}")
+        await asyncio.sleep(retry_delay)
+      except Exception as e:
+        metrics.inc("bot_exceptions_total", type=type(e).__name__)
+        logger.error(f"Encountered an exception: {e}")
+        traceback.print_exc()
+        await asyncio.sleep(retry_delay)
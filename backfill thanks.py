@@ -0,0 +1,54 @@
+# one-time job: fill the thanks store's once per thread index from the bot's past replies
+#
+# every "Thanks for u/<user> registered." reply the bot made is a reply to OP's
+# !thanks comment, so the thread, thanker and thanked user can all be recovered.
+# Parents are fetched 100 at a time with reddit.info. Safe to run more than once.
+# Reddit only lists a user's newest 1000 comments, so older thanks are not found
+import praw, re, json, logging
+from thanks_store import ThanksStore
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+logger = logging.getLogger(__name__)
+
+registered_pattern = re.compile(r"Thanks for u/([A-Za-z0-9_-]+) registered\.")
+
+with open('config.json') as config_file:
+  config = json.load(config_file)
+
+reddit_password = config.get('reddit_password')
+twofa = input("Please provide 2FA token, or leave blank\n").strip()
+if twofa:
+  reddit_password = reddit_password + ":" + twofa
+
+reddit = praw.Reddit(
+  client_id = config.get('client_id'),
+  client_secret = config.get('client_secret'),
+  username = config.get('reddit_username'),
+  password = reddit_password,
+  user_agent = "PyEng Bot 0.1",
+)
+subreddit = reddit.subreddit(config.get('subreddit'))
+thanks_store = ThanksStore(config.get('state_db_path', 'bot_state.db'), subreddit, config.get('thanks_wiki_page'))
+
+# the bot's replies registering a thanks, parent fullname -> (submission ID, thanked user)
+registered = {}
+bot_comments = 0
+for bot_comment in reddit.user.me().comments.new(limit=None):
+  bot_comments += 1
+  match = registered_pattern.search(bot_comment.body)
+  if match and bot_comment.parent_id.startswith("t1_"):
+    registered[bot_comment.parent_id] = (bot_comment.link_id[3:], match.group(1))
+logger.info(f"Found {len(registered)} registered thanks in {bot_comments} bot comments")
+
+added = 0
+fullnames = list(registered)
+for i in range(0, len(fullnames), 100):
+  for thanks_comment in reddit.info(fullnames=fullnames[i:i + 100]):
+    # the !thanks comment may have been deleted since
+    if not thanks_comment.author:
+      continue
+    submission_id, thanked = registered[thanks_comment.fullname]
+    if thanks_store.record_thanked(submission_id, thanks_comment.author.name, thanked):
+      added += 1
+
+logger.info(f"Added {added} thanks to the index, {len(thanks_store.thanked)} in total")
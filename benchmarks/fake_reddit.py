@@ -0,0 +1,184 @@
+# an in-process stand-in for praw.Reddit used by the benchmarks
+#
+# only implements what the bot touches. Every network call PRAW would make
+# (lazy fetches, replies, flair changes, moderator lists) sleeps for the
+# configured latency and is counted, so results show API calls per comment.
+import itertools, threading, time
+from collections import Counter
+
+class FakeRedditor:
+  def __init__(self, name):
+    self.name = name
+
+  def __eq__(self, other):
+    name = other.name if isinstance(other, FakeRedditor) else other
+    return isinstance(name, str) and name.lower() == self.name.lower()
+
+  def __hash__(self):
+    return hash(self.name.lower())
+
+  def __str__(self):
+    return self.name
+
+class FakeUser:
+  def __init__(self, reddit, name):
+    self.reddit = reddit
+    self.name = name
+
+  def me(self):
+    return FakeRedditor(self.name)
+
+class FakeAuth:
+  def __init__(self):
+    self.limits = {"remaining": None, "reset_timestamp": None, "used": None}
+
+class FakeSubreddit:
+  def __init__(self, reddit, display_name):
+    self.reddit = reddit
+    self.display_name = display_name
+
+  def moderator(self):
+    self.reddit.call("moderator")
+    return [FakeRedditor(name) for name in self.reddit.moderators]
+
+  # listing used by catch-up, nothing is ever missed here
+  def comments(self, limit=None):
+    self.reddit.call("listing")
+    return iter(())
+
+  def __str__(self):
+    return self.display_name
+
+class FakeMod:
+  def __init__(self, thing):
+    self.thing = thing
+
+  def distinguish(self, sticky=False):
+    self.thing.reddit.call("distinguish")
+
+class FakeFlair:
+  def __init__(self, thing):
+    self.thing = thing
+
+  def select(self, template_id):
+    self.thing.reddit.call("flair")
+    self.thing.reddit.flairs[self.thing.id] = template_id
+
+# a comment or submission; fields in lazy_fields are only available after a
+# simulated fetch, like PRAW objects created from an ID
+class FakeThing:
+  lazy_fields = ()
+
+  def __init__(self, reddit, id, fetched=True, **data):
+    self.reddit = reddit
+    self.id = id
+    self._data = data
+    self._fetched = fetched
+    self.mod = FakeMod(self)
+    self.flair = FakeFlair(self)
+
+  def __getattr__(self, name):
+    data = self.__dict__.get("_data", {})
+    if name in type(self).lazy_fields and not self.__dict__.get("_fetched"):
+      self.reddit.call(f"fetch_{type(self).kind}")
+      self._fetched = True
+    if name in data:
+      return data[name]
+    raise AttributeError(name)
+
+  def reply(self, body):
+    self.reddit.call("reply")
+    return FakeComment(self.reddit, self.reddit.new_id(), body=body, author=FakeRedditor(self.reddit.user.name))
+
+class FakeSubmission(FakeThing):
+  kind = "submission"
+  lazy_fields = ("author", "title", "selftext", "permalink", "subreddit", "link_flair_template_id")
+
+  @property
+  def fullname(self):
+    return f"t3_{self.id}"
+
+class FakeComment(FakeThing):
+  kind = "comment"
+  lazy_fields = ("author", "body", "permalink", "created_utc")
+
+  @property
+  def fullname(self):
+    return f"t1_{self.id}"
+
+  def parent(self):
+    parent = self._data["parent"]
+    # like PRAW, the parent is a new lazy object that still has to be fetched
+    if isinstance(parent, FakeSubmission):
+      return FakeSubmission(self.reddit, parent.id, fetched=False, **parent._data)
+    return FakeComment(self.reddit, parent.id, fetched=False, **parent._data)
+
+class FakeReddit:
+  def __init__(self, latency=0.0, bot_name="NothingTechBot", moderators=("NothingTechMod",)):
+    self.latency = latency
+    self.moderators = list(moderators)
+    self.calls = Counter()
+    self.lock = threading.Lock()
+    self.ids = itertools.count(1)
+    self.flairs = {}
+    self.auth = FakeAuth()
+    self.user = FakeUser(self, bot_name)
+    self.things = {}
+
+  def call(self, kind):
+    with self.lock:
+      self.calls[kind] += 1
+    if self.latency:
+      time.sleep(self.latency)
+
+  def total_calls(self):
+    with self.lock:
+      return sum(self.calls.values())
+
+  # lazy fetches only, replies and flair changes are sent later by the outbound queue
+  def fetch_calls(self):
+    with self.lock:
+      return sum(count for kind, count in self.calls.items() if kind.startswith("fetch_"))
+
+  def new_id(self):
+    return f"fake{next(self.ids):x}"
+
+  def subreddit(self, display_name):
+    return FakeSubreddit(self, display_name)
+
+  def comment(self, id):
+    thing = self.things.get(id)
+    data = thing._data if thing else {}
+    return FakeComment(self, id, fetched=False, **data)
+
+  def submission(self, id):
+    thing = self.things.get(id)
+    data = thing._data if thing else {}
+    return FakeSubmission(self, id, fetched=False, **data)
+
+  # like reddit.info, lazy-free objects for fullnames that exist
+  def info(self, fullnames):
+    self.call("info")
+    return [self.things[fullname[3:]] for fullname in fullnames if fullname[3:] in self.things]
+
+  def add(self, thing):
+    self.things[thing.id] = thing
+    return thing
+
+  # a streamed comment: body, author and IDs are included, parent and submission are lazy
+  def stream_comment(self, body, author, submission, parent=None):
+    parent = parent or submission
+    subreddit = submission._data["subreddit"]
+    comment = FakeComment(
+      self, self.new_id(),
+      body=body,
+      author=FakeRedditor(author),
+      subreddit=subreddit,
+      submission=FakeSubmission(self, submission.id, fetched=False, **submission._data),
+      link_id=submission.fullname,
+      parent_id=parent.fullname,
+      parent=parent,
+      permalink=f"/r/{subreddit}/comments/{submission.id}/_/",
+      created_utc=time.time(),
+    )
+    return self.add(comment)
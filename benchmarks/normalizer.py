@@ -0,0 +1,58 @@
+# microbenchmark for TextNormalizer against the old per-call sanitise_command
+#
+# run from the repo root: python benchmarks/normalizer.py [iterations]
+import os, sys, re, string, random, time, configparser, yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from normalizer import TextNormalizer, emoticon_pattern, emoji_pattern
+
+# sanitise_command as it was before TextNormalizer, rebuilding every pattern per call
+def sanitise_command_per_call(argument, remove_words_setting):
+  remove_words = remove_words_setting.split(', ')
+  pattern = r'\b(?:' + '|'.join(map(re.escape, remove_words)) + r')\b'
+  argument = re.sub(pattern, '', argument, flags=re.IGNORECASE)
+  argument = re.sub(emoticon_pattern, '', argument)
+  argument = re.sub(emoji_pattern, '', argument)
+  argument = argument.translate(str.maketrans('', '', string.punctuation))
+  argument = re.sub(r'\s+', ' ', argument).strip()
+  return argument
+
+# command arguments the way people type them: catalog aliases with filler words, punctuation and emoji around them
+def build_corpus(commands_data, size=5000, seed=1):
+  random.seed(seed)
+  aliases = [str(alias) for entries in commands_data.values() for entry in entries for alias in entry['aliases']]
+  prefixes = ["", "", "the ", "nothing ", "about the ", "for ", "btw "]
+  suffixes = ["", "", "?", "!", " pls", " :)", " 🙏", " app", "...", " page", " :P"]
+  return [
+    (random.choice(prefixes) + random.choice(aliases) + random.choice(suffixes)).lower()
+    for _ in range(size)
+  ]
+
+def measure(function, corpus, iterations):
+  start = time.perf_counter()
+  for _ in range(iterations):
+    for argument in corpus:
+      function(argument)
+  return (time.perf_counter() - start) / (iterations * len(corpus))
+
+if __name__ == '__main__':
+  iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+  config_parser = configparser.ConfigParser()
+  with open('bot_config.txt', 'r') as bot_config_file:
+    config_parser.read_string(bot_config_file.read().strip())
+  remove_words_setting = config_parser['bot']['remove_words']
+  with open('commands.yaml', 'r') as f:
+    corpus = build_corpus(yaml.safe_load(f))
+
+  normalizer = TextNormalizer(remove_words_setting.split(', '))
+  differences = [argument for argument in corpus if normalizer.normalize(argument) != sanitise_command_per_call(argument, remove_words_setting)]
+
+  per_call = measure(lambda argument: sanitise_command_per_call(argument, remove_words_setting), corpus, iterations)
+  compiled = measure(normalizer.normalize, corpus, iterations)
+
+  print(f"corpus: {len(corpus)} arguments x {iterations} iterations")
+  print(f"per-call patterns: {per_call * 1e6:.2f}us/argument ({1 / per_call:,.0f}/s)")
+  print(f"TextNormalizer:    {compiled * 1e6:.2f}us/argument ({1 / compiled:,.0f}/s)")
+  print(f"speedup: {per_call / compiled:.1f}x, {len(differences)} arguments normalised differently")
+  for argument in differences[:10]:
+    print(f"  {argument!r}: {sanitise_command_per_call(argument, remove_words_setting)!r} vs {normalizer.normalize(argument)!r}")
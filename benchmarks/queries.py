@@ -0,0 +1,153 @@
+# runs a file of link command queries through the real link_commands code, offline
+#
+# run from the repo root:
+#   python benchmarks/queries.py queries.txt [--type wiki] [--processes 4]
+#   python benchmarks/queries.py recorded.jsonl [--output results.csv]
+#
+# a text file has one query per line, either a full command ("!app simone")
+# or just the argument, searched as --type. A .jsonl file is a recorded
+# stream as used by replay.py, every link command in each body is queried.
+# Queries are split across processes, each with its own Bot on a fake Reddit.
+# Reports exact/ranked/fuzzy/miss counts per type, the most frequent queries without
+# an exact match with the entry they're closest to (candidates for new aliases in
+# commands.yaml) and queries/sec, and exits non-zero if --min-rate isn't met.
+import os, sys, csv, json, time, argparse, configparser, logging
+from collections import Counter, defaultdict
+from multiprocessing import Pool
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from bot import Bot, find_commands, command_argument, link_command_types
+from normalizer import TextNormalizer
+from fake_reddit import FakeReddit
+
+link_types = sorted(set(link_command_types.values()))
+
+# one per worker process, see start_worker
+worker_bot = None
+
+def load_bot_config(path):
+  config_parser = configparser.ConfigParser()
+  with open(path, 'r') as bot_config_file:
+    config_parser.read_string(bot_config_file.read().strip())
+  return config_parser['bot']
+
+def make_bot(commands_path, config_path):
+  config_wiki = load_bot_config(config_path)
+  config = {"solved_flair_template_ids": {}, "bool_send_response": False}
+  bot = Bot(FakeReddit(), "NothingTech", config, config_wiki, TextNormalizer.from_config(config_wiki), None, None, None, commands_path=commands_path)
+  bot.load_commands_if_updated()
+  return bot
+
+def start_worker(commands_path, config_path, cached):
+  global worker_bot
+  logging.basicConfig(level=logging.WARNING)
+  worker_bot = make_bot(commands_path, config_path)
+  # without the response cache every query goes through the matching code
+  if not cached:
+    worker_bot.link_response = worker_bot._link_response
+
+# (type, query, normalised argument, result, seconds) for one query
+def run_query(query):
+  type, argument = query
+  start = time.perf_counter()
+  if not argument:
+    normalised, result = "", "usage"
+  else:
+    normalised = worker_bot.sanitise_command(argument)
+    result, response = worker_bot.link_response(type, normalised, worker_bot.catalog_version())
+  return type, argument, normalised, result, time.perf_counter() - start
+
+# (type, argument) pairs, from a plain query list or a recorded stream
+def read_queries(path, default_type):
+  queries = []
+  with open(path, 'r') as f:
+    for line in f:
+      line = line.strip()
+      if not line:
+        continue
+      body = json.loads(line)["body"].lower() if path.endswith(".jsonl") else line.lower()
+      matches = [match for match in find_commands(body) if match.command in link_command_types]
+      if matches:
+        queries.extend((link_command_types[match.command], command_argument(body, match)) for match in matches)
+      elif not path.endswith(".jsonl"):
+        queries.append((default_type, body))
+  return queries
+
+def percentile(values, fraction):
+  values = sorted(values)
+  return values[min(int(len(values) * fraction), len(values) - 1)] if values else 0.0
+
+def main():
+  parser = argparse.ArgumentParser(description="Resolve a file of link command queries offline and report how they match")
+  parser.add_argument("queries", help="text file with one query per line, or a .jsonl recorded stream")
+  parser.add_argument("--type", default="wiki", choices=link_types, help="type for lines that are just an argument")
+  parser.add_argument("--processes", type=int, default=os.cpu_count(), help="worker processes, defaults to one per core")
+  parser.add_argument("--commands", default="commands.yaml", help="path to commands.yaml")
+  parser.add_argument("--config", default="bot_config.txt", help="bot config with the remove_words and footers")
+  parser.add_argument("--cached", action="store_true", help="use the bot's response cache, so repeated queries are only resolved once per process")
+  parser.add_argument("--top", type=int, default=20, help="number of frequent misses to suggest aliases for")
+  parser.add_argument("--output", help="write every query and its result to this CSV file")
+  parser.add_argument("--min-rate", type=float, help="fail if fewer queries/sec than this are resolved")
+  args = parser.parse_args()
+  logging.basicConfig(level=logging.WARNING)
+
+  queries = read_queries(args.queries, args.type)
+  if not queries:
+    print(f"No queries found in {args.queries}")
+    sys.exit(1)
+
+  # rebuilt here if it's stale, so the workers only load it. They do that before the clock starts
+  make_bot(args.commands, args.config)
+  with Pool(args.processes, initializer=start_worker, initargs=(args.commands, args.config, args.cached)) as pool:
+    pool.map(run_query, queries[:args.processes])
+    start = time.perf_counter()
+    results = pool.map(run_query, queries, chunksize=max(len(queries) // (args.processes * 8), 1))
+    elapsed = time.perf_counter() - start
+
+  counts = defaultdict(Counter)
+  latencies = defaultdict(list)
+  # queries with no exact match, by how often they were asked
+  unmatched = Counter()
+  for type, argument, normalised, result, seconds in results:
+    counts[type][result] += 1
+    latencies[type].append(seconds)
+    if result in ("ranked", "fuzzy", "miss"):
+      unmatched[(type, normalised)] += 1
+
+  rate = len(results) / elapsed
+  print(f"{len(results)} queries in {elapsed:.2f}s: {rate:,.0f} queries/sec ({args.processes} processes, response cache {'on' if args.cached else 'off'})")
+  results_names = ("exact", "ranked", "fuzzy", "miss", "too_long", "usage")
+  print(f"{'type':<8}{'count':>7}" + "".join(f"{name:>10}" for name in results_names) + f"{'p50 us':>10}{'p99 us':>10}")
+  for type in sorted(counts):
+    total = sum(counts[type].values())
+    print(f"{type:<8}{total:>7}" + "".join(f"{counts[type][name] / total:>10.1%}" for name in results_names)
+      + f"{percentile(latencies[type], 0.5) * 1e6:>10.0f}{percentile(latencies[type], 0.99) * 1e6:>10.0f}")
+
+  if unmatched and args.top:
+    bot = make_bot(args.commands, args.config)
+    print("\nMost frequent queries without an exact match:")
+    for (type, normalised), count in unmatched.most_common(args.top):
+      # the best token search result, or a looser fuzzy search than the bot's own suggestions
+      ranked = bot.commands_index.search(type, normalised, n=1)
+      closest = bot.commands_index.suggest(type, normalised, n=1, cutoff=0.4)
+      if ranked:
+        target = f"closest entry `{ranked[0][1]['display_name']}`"
+      elif closest:
+        target = f"closest entry `{bot.commands_index.display_name(type, closest[0])}`"
+      else:
+        target = "no close entry"
+      print(f"{count:>6}  !{type} {normalised}  ->  {target}")
+
+  if args.output:
+    with open(args.output, 'w', newline='') as output_file:
+      writer = csv.writer(output_file)
+      writer.writerow(["type", "query", "normalised", "result"])
+      writer.writerows(result[:4] for result in results)
+    print(f"\nWrote {len(results)} results to {args.output}")
+
+  if args.min_rate is not None and rate < args.min_rate:
+    print(f"FAIL: {rate:,.0f} queries/sec is below {args.min_rate}")
+    sys.exit(1)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,202 @@
+# replays a comment stream through the real Bot handlers against a fake Reddit
+#
+# run from the repo root:
+#   python benchmarks/replay.py [--comments 2000] [--latency 0.005] [--workers 0]
+#   python benchmarks/replay.py --replay recorded.jsonl
+#
+# a recorded stream is one JSON object per line with body, author, submission,
+# submission_author and optionally parent_author / parent_body for replies.
+# Reports comments/sec, p50/p99 latency per command and Reddit API calls per
+# comment, and exits non-zero if --max-p99-ms or --min-rate aren't met.
+import os, sys, json, random, time, argparse, configparser, logging, threading
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import yaml
+from bot import Bot, command_pattern
+from normalizer import TextNormalizer
+from permissions import PermissionsCache
+from checkpoint import StreamCheckpoint
+from outbound import ActionQueue
+from pipeline import CommentPipeline
+from fake_reddit import FakeReddit, FakeSubmission, FakeRedditor, FakeSubreddit
+
+subreddit_name = "NothingTech"
+chatter = [
+  "Anyone else getting worse battery since the last update?",
+  "I love the glyph interface on this phone",
+  "Have you tried restarting it? That fixed it for me.",
+  "Same here, waiting for the next OTA",
+  "Which case are you using? Looks great",
+  "lol this is the way",
+]
+
+def load_bot_config():
+  config_parser = configparser.ConfigParser()
+  with open('bot_config.txt', 'r') as bot_config_file:
+    config_parser.read_string(bot_config_file.read().strip())
+  return config_parser['bot']
+
+# a mix of link commands (hits, typos and misses), !solved, !answer, !support (sometimes with
+# several !wiki lines), !bug and plain chatter
+def synthetic_stream(reddit, count, seed=1):
+  random.seed(seed)
+  with open('commands.yaml', 'r') as f:
+    commands_data = yaml.safe_load(f)
+  subreddit = FakeSubreddit(reddit, subreddit_name)
+  users = [f"user{i}" for i in range(50)]
+  submissions = [
+    reddit.add(FakeSubmission(reddit, reddit.new_id(), author=FakeRedditor(random.choice(users)), subreddit=subreddit, selftext="help", permalink="/p", link_flair_template_id=None))
+    for _ in range(max(count // 20, 1))
+  ]
+
+  stream = []
+  for _ in range(count):
+    submission = random.choice(submissions)
+    op = submission._data["author"].name
+    helper = random.choice(users)
+    roll = random.random()
+    if roll < 0.75:
+      stream.append(reddit.stream_comment(random.choice(chatter), helper, submission))
+    elif roll < 0.90:
+      command = random.choice(["wiki", "app", "link", "glyph", "toy"])
+      alias = str(random.choice(random.choice(commands_data[command])["aliases"]))
+      kind = random.random()
+      if kind < 0.2 and len(alias) > 3:
+        # typo, goes to fuzzy suggestions
+        position = random.randrange(len(alias))
+        alias = alias[:position] + alias[position + 1:]
+      elif kind < 0.3:
+        alias = "something that isn't in the catalog"
+      stream.append(reddit.stream_comment(f"!{command} {alias}", helper, submission))
+    elif roll < 0.94:
+      stream.append(reddit.stream_comment("Thanks, that worked! !solved", op, submission))
+    elif roll < 0.97:
+      answer = reddit.stream_comment("Turn it off and on again", helper, submission)
+      stream.append(reddit.stream_comment("!answer", op, submission, parent=answer))
+    elif roll < 0.985:
+      # half also ask for links, answered in the same reply
+      if random.random() < 0.5:
+        aliases = [str(random.choice(commands_data["wiki"])["aliases"][0]) for _ in range(2)]
+        stream.append(reddit.stream_comment("!support\n" + "\n".join(f"!wiki {alias}" for alias in aliases), helper, submission))
+      else:
+        stream.append(reddit.stream_comment("!support", helper, submission))
+    else:
+      stream.append(reddit.stream_comment("!bug", helper, submission))
+  return stream
+
+def recorded_stream(reddit, path):
+  subreddit = FakeSubreddit(reddit, subreddit_name)
+  submissions = {}
+  stream = []
+  with open(path, 'r') as f:
+    for line in f:
+      if not line.strip():
+        continue
+      record = json.loads(line)
+      submission = submissions.get(record["submission"])
+      if not submission:
+        submission = reddit.add(FakeSubmission(reddit, record["submission"], author=FakeRedditor(record["submission_author"]), subreddit=subreddit, selftext="", permalink="/p", link_flair_template_id=None))
+        submissions[record["submission"]] = submission
+      parent = None
+      if record.get("parent_author"):
+        parent = reddit.stream_comment(record.get("parent_body", ""), record["parent_author"], submission)
+      stream.append(reddit.stream_comment(record["body"], record["author"], submission, parent=parent))
+  return stream
+
+def command_name(body):
+  match = command_pattern.search(body)
+  return match.group(0).lower() if match else "chatter"
+
+def percentile(values, fraction):
+  values = sorted(values)
+  return values[min(int(len(values) * fraction), len(values) - 1)] if values else 0.0
+
+def main():
+  parser = argparse.ArgumentParser(description="Replay a comment stream through the bot against a fake Reddit")
+  parser.add_argument("--comments", type=int, default=2000, help="number of synthetic comments")
+  parser.add_argument("--replay", help="JSONL file of recorded comments instead of a synthetic stream")
+  parser.add_argument("--latency", type=float, default=0.005, help="simulated seconds per Reddit API call")
+  parser.add_argument("--workers", type=int, default=0, help="use the threaded pipeline with this many workers")
+  parser.add_argument("--max-p99-ms", type=float, help="fail if any command's p99 latency is above this")
+  parser.add_argument("--min-rate", type=float, help="fail if fewer comments/sec than this are handled")
+  args = parser.parse_args()
+
+  logging.basicConfig(level=logging.WARNING)
+  reddit = FakeReddit(latency=args.latency)
+  config = {
+    "solved_flair_template_ids": {subreddit_name: "solved-template"},
+    "bool_send_response": True,
+    "catchup_enabled": False,
+  }
+  config_wiki = load_bot_config()
+  permissions = PermissionsCache(reddit, [subreddit_name], refresh_interval=0)
+  checkpoint = StreamCheckpoint(":memory:")
+  actions = ActionQueue(reddit, ":memory:", rate=1e9, burst=1e9)
+  bot = Bot(reddit, subreddit_name, config, config_wiki, TextNormalizer.from_config(config_wiki), permissions, checkpoint, actions)
+  bot.load_commands_if_updated()
+
+  stream = recorded_stream(reddit, args.replay) if args.replay else synthetic_stream(reddit, args.comments)
+  reddit.calls.clear()
+
+  latencies = defaultdict(list)
+  fetches = defaultdict(int)
+  lock = threading.Lock()
+
+  # time each comment through the real handlers
+  def timed(comment):
+    fetches_before = reddit.fetch_calls()
+    start = time.perf_counter()
+    bot.process_comment(comment)
+    elapsed = time.perf_counter() - start
+    with lock:
+      name = command_name(comment.body)
+      latencies[name].append(elapsed)
+      # approximate with workers, as fetches from other threads can land in between
+      fetches[name] += reddit.fetch_calls() - fetches_before
+
+  if args.workers:
+    bot.pipeline = CommentPipeline(timed, args.workers, stats_interval=3600)
+
+  start = time.perf_counter()
+  for comment in stream:
+    # chatter is only timed through the pre-filter
+    prefilter_start = time.perf_counter()
+    if not bot.has_command(comment):
+      latencies["chatter"].append(time.perf_counter() - prefilter_start)
+      continue
+    if bot.pipeline:
+      bot.pipeline.submit(comment, comment.link_id)
+    else:
+      timed(comment)
+  if bot.pipeline:
+    for comments in bot.pipeline.queues:
+      comments.join()
+  handled = time.perf_counter() - start
+
+  # let the outbound queue finish so writes are counted too
+  while actions.depth():
+    time.sleep(0.01)
+
+  total_calls = reddit.total_calls()
+  rate = len(stream) / handled
+  print(f"{len(stream)} comments in {handled:.2f}s: {rate:,.0f} comments/sec ({args.latency * 1000:.1f}ms per API call, {args.workers or 'no'} workers)")
+  print(f"{'command':<12}{'count':>7}{'p50 ms':>10}{'p99 ms':>10}{'fetches/comment':>17}")
+  worst_p99 = 0.0
+  for name, values in sorted(latencies.items(), key=lambda item: -len(item[1])):
+    p99 = percentile(values, 0.99) * 1000
+    worst_p99 = max(worst_p99, p99)
+    print(f"{name:<12}{len(values):>7}{percentile(values, 0.5) * 1000:>10.2f}{p99:>10.2f}{fetches[name] / len(values):>17.2f}")
+  print(f"API calls including outbound writes: {total_calls} total, {total_calls / len(stream):.3f} per comment, {dict(reddit.calls)}")
+
+  failed = False
+  if args.max_p99_ms is not None and worst_p99 > args.max_p99_ms:
+    print(f"FAIL: worst p99 {worst_p99:.2f}ms is above {args.max_p99_ms}ms")
+    failed = True
+  if args.min_rate is not None and rate < args.min_rate:
+    print(f"FAIL: {rate:,.0f} comments/sec is below {args.min_rate}")
+    failed = True
+  sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+  main()
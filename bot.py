@@ -0,0 +1,536 @@
+import functools, logging, os, re, threading, time, traceback
+from command_index import CommandIndex
+from catalog import load_catalog
+from comment_context import CommentContext
+from checkpoint import fetch_missed_comments
+from metrics import metrics
+from submission_cache import SubmissionCache
+
+logger = logging.getLogger(__name__)
+
+prefilter_log_every = 1000
+
+# Reddit's limit on the length of a comment
+max_reply_length = 10000
+# between the responses to several commands answered in one reply
+reply_separator = "\n\n---\n\n"
+
+# longest argument searched at all, in words
+max_query_words = 20
+# fuzzy suggestions compare whole strings, so only short arguments are worth
+# comparing (spaces allowed per type). Longer ones only use the token search
+fuzzy_max_spaces = {"wiki": 4, "glyph": 4, "app": 4, "toy": 4, "link": 2}
+# how far ahead of the next entry the best token search result must score to be answered on its own
+ranked_lead = 1.5
+
+# bot_config.txt settings that appear in link_commands responses
+response_footer_keys = ("wiki_footer", "app_footer", "glyph_footer", "wiki_no_match_footer", "link_no_match_footer")
+
+# a command found in a comment body and where it is
+class CommandMatch:
+  __slots__ = ("command", "start", "end")
+
+  def __init__(self, command, start, end):
+    self.command = command
+    self.start = start
+    self.end = end
+
+# every command in the body with its position, in the order they appear
+def find_commands(comment_body):
+  return [CommandMatch(match.group(0).lower(), match.start(), match.end()) for match in command_pattern.finditer(comment_body)]
+
+def is_command_quoted(comment_body, match) -> bool:
+  # check if the command is surrounded by quotes (", ', `), optionally with spaces or escaped quotes
+  before = comment_body[:match.start].rstrip().rstrip("\\")
+  after = comment_body[match.end:].lstrip().lstrip("\\")
+  return bool(before) and before[-1] in "\"'`" and after[:1] == before[-1]
+
+# the rest of the line after the command, up to the next command on the same line
+def command_argument(comment_body, match):
+  endidx = comment_body.find("\n", match.end)
+  if endidx == -1:
+    endidx = len(comment_body)
+  next_command = command_pattern.search(comment_body, match.end, endidx)
+  if next_command:
+    endidx = next_command.start()
+  return comment_body[match.end:endidx].strip()
+
+# responses joined into as few replies as fit in a Reddit comment
+def combine_responses(responses, footer):
+  replies = []
+  current = ""
+  for response in responses:
+    combined = current + reply_separator + response if current else response
+    if current and len(combined) + len(footer) + 2 > max_reply_length:
+      replies.append(current)
+      combined = response
+    current = combined
+  if current:
+    replies.append(current)
+  return [reply + '\n\n' + footer for reply in replies]
+
+# the command handlers, kept apart from the Reddit login and stream loop in main.py
+# so they can also be driven by the benchmarks against a fake Reddit
+class Bot:
+  def __init__(self, reddit, subreddit_names, config, config_wiki, normalizer, permissions, checkpoint, actions, commands_path="commands.yaml", catalog_path="commands.catalog"):
+    self.reddit = reddit
+    self.subreddit_names = subreddit_names
+    self.subreddit = reddit.subreddit(subreddit_names)
+    self.config_wiki = config_wiki
+    self.normalizer = normalizer
+    self.permissions = permissions
+    self.checkpoint = checkpoint
+    self.actions = actions
+    # set by main.py in pipeline mode
+    self.pipeline = None
+
+    self.solved_flair_template_ids = config['solved_flair_template_ids']
+    self.bool_send_response = config['bool_send_response']
+    # cross-check fuzzy suggestions against difflib and log any differences
+    self.fuzzy_verify = config.get('fuzzy_verify', False)
+    # catch-up of comments missed while the bot was down
+    self.catchup_enabled = config.get('catchup_enabled', True)
+    self.catchup_overlap = config.get('catchup_overlap', 300)
+    self.catchup_max_age = config.get('catchup_max_age', 86400)
+    self.catchup_limit = config.get('catchup_limit', 1000)
+    # times a comment's handlers may fail before it's given up on
+    self.comment_max_attempts = config.get('comment_max_attempts', 3)
+    # seconds between retries of failed comments while the stream runs, 0 to only retry on catch-up
+    self.failed_retry_interval = config.get('failed_retry_interval', 300)
+
+    self.commands_path = commands_path
+    # precompiled by catalog.py, rebuilt from commands_path when stale
+    self.catalog_path = catalog_path
+    self.commands_data = {}
+    self.commands_index = CommandIndex({})
+    self.commands_mtime = 0
+    # bumped on every reload, part of the response cache key
+    self.commands_version = 0
+    # workers may call this at the same time in pipeline mode
+    self.commands_lock = threading.Lock()
+
+    self.prefilter_counts = {"skipped": 0, "dispatched": 0}
+    # rendered link_commands responses for popular queries
+    self.link_response = functools.lru_cache(maxsize=config.get('response_cache_size', 1024))(self._link_response)
+    # submission author, subreddit and flair shared between comments in the same thread
+    self.submission_cache = SubmissionCache(config.get('submission_cache_size', 1000), config.get('submission_cache_ttl', 600))
+
+  def load_commands_if_updated(self):
+    try:
+      current_mtime = os.path.getmtime(self.commands_path)
+      if current_mtime > self.commands_mtime:
+        with self.commands_lock:
+          if current_mtime > self.commands_mtime:
+            # the lookup tables come prebuilt from the catalog unless commands.yaml changed since
+            self.commands_data, self.commands_index = load_catalog(self.commands_path, self.normalizer, self.catalog_path)
+            self.commands_version += 1
+            # entries for the old version can never match again
+            logger.debug(f"Response cache before reload: {self.link_response.cache_info()}")
+            self.link_response.cache_clear()
+            self.commands_mtime = current_mtime
+            logger.info(f"Reloaded {self.commands_path} (modified at {current_mtime})")
+    except Exception as e:
+        logger.error(f"Error loading YAML: {e}")
+
+  # responses are collected while the comment's handlers run and sent together by send_replies
+  def send_reply(self, ctx, response):
+    response = response.replace("<user>", f"u/{ctx.author_name}")
+    # e.g. the same !wiki query twice
+    if response not in ctx.responses:
+      ctx.responses.append(response)
+
+  # one reply for every command in the comment, split only if it's too long for Reddit
+  def send_replies(self, ctx):
+    if not ctx.responses:
+      return
+    replies = combine_responses(ctx.responses, self.config_wiki['footer'])
+    ctx.responses = []
+
+    for reply in replies:
+      if self.bool_send_response:
+        logger.debug(f"Queueing reply: {reply}")
+        self.actions.reply(ctx.comment.id, reply)
+        ctx.record_call()
+      else:
+        logger.info("Reply not sent as bool_send_response is false.")
+        logger.info(f"Reply would've been: {reply}")
+
+  def add_comment(self, ctx, content, sticky):
+    logger.info(f"Adding comment to {ctx.submission.id}")
+    self.actions.submission_reply(ctx.submission.id, content + '\n\n' + self.config_wiki['footer'], sticky)
+    ctx.record_call(2 if sticky else 1)
+
+  def set_solved_flair(self, ctx):
+    template_id = self.solved_flair_template_ids.get(ctx.subreddit_name)
+    self.actions.flair(ctx.submission.id, template_id)
+    # the change is only queued and may be dropped, so the next comment fetches the real flair
+    self.submission_cache.invalidate(ctx.submission.id)
+    ctx.record_call()
+
+  # check if the comment body could contain a command. Only uses comment.body, which is part
+  # of the streamed data, so comments without a command never trigger a lazy fetch
+  def has_command(self, comment):
+    metrics.inc("bot_comments_seen_total")
+    if command_pattern.search(comment.body):
+      self.prefilter_counts["dispatched"] += 1
+      matched = True
+    else:
+      self.prefilter_counts["skipped"] += 1
+      matched = False
+
+    seen = self.prefilter_counts["skipped"] + self.prefilter_counts["dispatched"]
+    if seen % prefilter_log_every == 0:
+      logger.info(f"Pre-filter: {seen} comments seen, {self.prefilter_counts['dispatched']} dispatched, {self.prefilter_counts['skipped']} skipped")
+
+    return matched
+
+  def sanitise_command(self, argument):
+    return self.normalizer.normalize(argument)
+
+  def link_commands(self, type, argument):
+    if not argument:
+      logger.debug(f"!{type} request found but no argument specified")
+      metrics.inc("bot_link_results_total", type=type, result="usage")
+
+      if type == "glyph":
+          return ("You can view all community Glyph projects here: https://reddit.com/r/NothingTech/wiki/library/glyph-projects/\n\n"
+                "You can also use this command to find specific Glyph projects, e.g. `!glyph bngc` or `!glyph glyphtones`.")
+      elif type == "app":
+          return ("You can view all community apps here: https://reddit.com/r/NothingTech/wiki/library/community-apps/\n\n"
+                "You can also use this command to find specific apps, e.g. `!app simone` or `!app glyphify`.")
+      elif type == "wiki":
+          return ("Here's the link to our wiki: https://reddit.com/r/NothingTech/wiki\n\n"
+                "You can also use this command to find specific topics, e.g. `!wiki nfc icon` or `!wiki phone chargers`.")
+      elif type == "toy":
+          return ("You can view all community toys here: https://www.reddit.com/r/NothingTech/wiki/library/glyph-projects/#wiki_community_glyph_matrix_toys\n\n"
+                "You can also use this command to find specific toys, e.g. `!toy magic 8 ball` or `!toy counter`.")
+      elif type == "link":
+          return ("You can view all of Nothing's official links here: https://reddit.com/mod/NothingTech/wiki/library/official-links\n\n"
+                "You can also use this command to find specific links, e.g. `!link phone (3a)` or `!link nothing discord`.")
+        
+
+    argument = self.sanitise_command(argument)
+    logger.info(f"!{type} request for {argument} found")
+
+    result, response = self.link_response(type, argument, self.catalog_version())
+    metrics.inc("bot_link_results_total", type=type, result=result)
+    return response
+
+  # the catalog and footers a response was rendered from, cached responses are only reused for the same version
+  def catalog_version(self):
+    return (self.commands_version,) + tuple(self.config_wiki[key] for key in response_footer_keys)
+
+  # (result, rendered response) for a normalised argument, cached per catalog version by link_response
+  def _link_response(self, type, argument, catalog_version):
+    # too many words to be a search argument
+    if argument.count(" ") >= max_query_words:
+      return "too_long", self.config_wiki['link_no_match_footer'] if type == "link" else self.config_wiki['wiki_no_match_footer']
+
+    returned_link = None
+    result = "exact"
+    ranked = []
+
+    # check if the argument exact matches any aliases
+    search = self.commands_index.lookup(type, argument)
+    if not search:
+      # otherwise rank the entries by the words they share with the argument
+      ranked = self.commands_index.search(type, argument, n=3)
+      # a clear best match is answered like an exact one
+      if ranked and (len(ranked) == 1 or ranked[0][0] >= ranked_lead * ranked[1][0]):
+        search = ranked[0][1]
+        result = "ranked"
+    if search:
+      returned_display_name = search['display_name']
+      returned_link = search['link']
+
+    if returned_link:
+      if type == "wiki":
+        # if this is linking to a specific section of the wiki page
+        if "#" in returned_link:
+          return result, (f"Here's the link for **[{returned_display_name}]({returned_link})**.\n\n"
+                  f"This is a part of the page: {returned_link.split('#')[0]}\n\n"
+                  f"{self.config_wiki['wiki_footer']}")
+        else:
+          return result, f"Here's the link for `{returned_display_name}`: {returned_link}\n\n{self.config_wiki['wiki_footer']}"
+      else:
+        footer = ""
+        if type == "app":
+          footer = '\n\n' + self.config_wiki['app_footer']
+        elif type == "glyph" or type == "toy":
+          footer = '\n\n' + self.config_wiki['glyph_footer']
+
+        # return links for everything that isn't wiki (link, glyph, app)
+        return result, f"Here's the link for `{returned_display_name}`: {returned_link}{footer}"
+    else:
+      # get close matches for the argument vs the aliases
+      suggestions = []
+      if argument.count(" ") <= fuzzy_max_spaces[type]:
+        suggestions = self.commands_index.suggest(type, argument, n=3, cutoff=0.6, verify=self.fuzzy_verify)
+      if suggestions:
+        suggestion_lines = []
+        added_suggestions = set()
+        for suggestion in suggestions:
+          search = self.commands_index.lookup(type, suggestion)
+          # if we didn't already add this one, add it to the suggestions
+          if search and search['display_name'] not in added_suggestions:
+            suggestion_lines.append(f"* `{search['display_name']}`: {search['link']}")
+            added_suggestions.add(search['display_name'])
+        
+        suggestion_block = "\n".join(suggestion_lines)
+        return "fuzzy", f"I couldn't an exact match for `{argument}`. Did you mean any of the following?\n\n{suggestion_block}"
+      elif ranked:
+        # entries sharing words with the argument, when no alias is close to it as a whole
+        ranked_block = "\n".join(f"* `{entry['display_name']}`: {entry['link']}" for score, entry in ranked)
+        return "ranked", f"I couldn't find an exact match for `{argument}`. These are the closest:\n\n{ranked_block}"
+      else:
+        footer = self.config_wiki['link_no_match_footer'] if type == "link" else self.config_wiki['wiki_no_match_footer']
+        return "miss", f"I couldn't find a link for `{argument}` and no similar matches were found. If you think this is wrong, contact the mods.\n\n{footer}"
+
+  # !solved from OP or a mod of a submission, set solved flair
+  def handle_solved(self, ctx, match):
+    if ctx.author_is_op or ctx.author_is_mod:
+      logger.info("!solved found, changing flair")
+      self.set_solved_flair(ctx)
+      self.send_reply(ctx, self.config_wiki['solved_response'])
+    else:
+      logger.debug("!solved found but author is not OP or a mod, ignoring")
+
+  # !answer from OP or a mod of a submission, set solved flair and comment the solution
+  def handle_answer(self, ctx, match):
+    if ctx.author_is_op or ctx.author_is_mod:
+      logger.info("!answer found, generating reply and changing flair")
+      # check if there's a valid parent comment
+      if ctx.parent_is_submission:
+        self.send_reply(ctx, "You can only reply `!answer` to a comment providing the answer to your question. Did you mean `!solved`?")
+      else:
+        # can't set the bot as the answer
+        if ctx.permissions.is_bot(ctx.parent_author_name):
+          self.send_reply(ctx, "You can't set the bot's comment as the answer. Please use `!solved` to change the flair to solved.")
+        else:
+          if not ctx.author_is_op and ctx.author_is_mod:
+            content = (
+              "Mod u/{} marked the following comment as the best answer on behalf of u/{}:\n\n"
+              "> {}\n\n"
+              "> \\- by u/{} - [Jump to comment]({})"
+            ).format(
+              ctx.author_name,
+              ctx.submission_author_name,
+              ctx.parent_body.replace("\n\n", "\n\n> "),
+              ctx.parent_author_name,
+              ctx.parent_permalink
+            )
+          else:
+            content = (
+              "u/{} marked the following comment as the best answer:\n\n"
+              "> {}\n\n"
+              "> \\- by u/{} - [Jump to comment]({})"
+            ).format(
+              ctx.author_name,
+              ctx.parent_body.replace("\n\n", "\n\n> "),
+              ctx.parent_author_name,
+              ctx.parent_permalink
+            )
+
+          self.add_comment(ctx, content, True)
+          self.set_solved_flair(ctx)
+          self.send_reply(ctx, self.config_wiki['answer_response'])
+    else:
+      logger.debug("!answer found but author is not OP or a mod, ignoring")
+
+  # !support, respond with support links
+  def handle_support(self, ctx, match):
+    logger.info("!support found, responding with support links")
+    response = f"u/{ctx.parent_author_name}, here's how to get in touch with Nothing support:\n\n* Visit the [Nothing Support Centre](https://nothing.tech/pages/support-centre) and press the blue chat icon for live chat support (region and time dependent).\n* Visit the [Nothing Customer Support](https://nothing.tech/pages/contact-support) page to get in contact via web form.\n* Contact [\@NothingSupport on X](https://x.com/NothingSupport)."
+    self.send_reply(ctx, response)
+
+  # !bug or !feedback, respond with where to send feedback
+  def handle_bug(self, ctx, match):
+    logger.info(f"{match.command} found, responding with feedback instructions")
+    response = f"u/{ctx.parent_author_name}, be sure to submit bugs and feedback requests through your phone's Settings > System > Feedback menu."
+    self.send_reply(ctx, response)
+
+  # !link, !wiki, !glyph, !app or !toy, respond with the relevant link
+  def handle_link(self, ctx, match):
+    command_type = link_command_types[match.command]
+    logger.info(f"{match.command} found, doing {command_type} command")
+
+    self.load_commands_if_updated()
+
+    response = self.link_commands(command_type, command_argument(ctx.body, match))
+
+    if response:
+      self.send_reply(ctx, response)
+
+  # start handling a comment, returns its context or None if it should be skipped
+  def begin_comment(self, comment):
+    # never handle the same comment twice, e.g. after a restart
+    if self.checkpoint.is_processed(comment.id):
+      return None
+
+    ctx = CommentContext(comment, self.permissions, self.submission_cache)
+    logger.info(f"Found comment in {self.subreddit}, {comment.id} in {ctx.submission.id}")
+    logger.debug(f"Comment from {ctx.author_name}: {comment.body}")
+
+    # check if the comment is the bot's
+    if ctx.author_is_bot:
+      self.checkpoint.mark_processed(comment)
+      return None
+    return ctx
+
+  # handler -> the matches it runs for, ignoring quoted commands. Most handlers run
+  # once, for the first occurrence of any of their commands. Link commands run for
+  # every occurrence, e.g. several !link lines, and are answered in the same reply
+  def handlers_for(self, ctx):
+    handlers = {}
+    for match in find_commands(ctx.body):
+      handler = command_handlers[match.command]
+      if handler in handlers and handler not in repeatable_handlers:
+        continue
+      if is_command_quoted(ctx.body, match):
+        logger.info(f"{match.command} is quoted, ignoring")
+        continue
+      handlers.setdefault(handler, []).append(match)
+    return handlers
+
+  # run the handlers, then send the reply and mark the comment as processed
+  def run_handlers(self, ctx, handlers):
+    try:
+      for handler, matches in handlers.items():
+        for match in matches:
+          metrics.inc("bot_commands_total", command=match.command)
+          handler(self, ctx, match)
+    except Exception:
+      # nothing is replied, the whole comment is handled again when it's retried
+      ctx.responses = []
+      raise
+    self.send_replies(ctx)
+    self.checkpoint.mark_processed(ctx.comment)
+
+    logger.info(f"Comment {ctx.comment.id} cost {ctx.api_calls} Reddit API calls")
+
+  # a comment's handlers raised, retry_failed retries it until comment_max_attempts
+  def record_failure(self, comment):
+    attempts = self.checkpoint.mark_failed(comment)
+    if attempts >= self.comment_max_attempts:
+      logger.error(f"Giving up on comment {comment.id} after {attempts} failed attempts")
+      self.checkpoint.mark_processed(comment)
+    else:
+      logger.warning(f"Handling comment {comment.id} failed (attempt {attempts}), it will be retried")
+
+  # handle a single comment from the stream
+  def process_comment(self, comment):
+    ctx = self.begin_comment(comment)
+    if not ctx:
+      return
+    handlers = self.handlers_for(ctx)
+    try:
+      # what the handlers read is fetched first, so a failed fetch happens before anything is sent
+      ctx.load({need for handler in handlers for need in handler_prefetch[handler]})
+      self.run_handlers(ctx, handlers)
+    except Exception:
+      self.record_failure(comment)
+      raise
+
+  # whether a comment from the stream or catch-up should be handled
+  def should_dispatch(self, comment, since=None):
+    # skip anything from before the catch-up window or that was already handled
+    if since and comment.created_utc < since:
+      return False
+    self.checkpoint.update(self.subreddit_names, comment)
+    metrics.set("bot_stream_lag_seconds", time.time() - comment.created_utc)
+
+    if not self.has_command(comment):
+      logger.debug(f"Skipping comment {comment.id}, no command found")
+      return False
+
+    if self.checkpoint.is_processed(comment.id):
+      logger.debug(f"Skipping comment {comment.id}, already processed")
+      return False
+    return True
+
+  # handle a comment from the stream or from catch-up
+  def dispatch_comment(self, comment, since=None):
+    if not self.should_dispatch(comment, since):
+      return
+
+    if self.pipeline:
+      # link_id is part of the streamed data, so this doesn't fetch the submission
+      self.pipeline.submit(comment, comment.link_id)
+    else:
+      self.process_comment(comment)
+
+  # handle comments whose handlers failed again
+  def retry_failed(self):
+    failed = self.checkpoint.failed()
+    if failed:
+      logger.info(f"Retrying {len(failed)} comments whose handlers failed")
+      for comment in self.reddit.info(fullnames=failed):
+        self.dispatch_comment(comment)
+
+  # retry failed comments every failed_retry_interval seconds from a background thread,
+  # so they aren't left until the stream next fails and catch-up runs
+  def start_retrying_failed(self):
+    if self.failed_retry_interval > 0:
+      threading.Thread(target=self._retry_failed_loop, name="failed-comments-retry", daemon=True).start()
+
+  def _retry_failed_loop(self):
+    while True:
+      time.sleep(self.failed_retry_interval)
+      try:
+        self.retry_failed()
+      except Exception as e:
+        logger.error(f"Error retrying failed comments: {e}")
+        traceback.print_exc()
+
+  # process anything posted since the last checkpoint and retry comments whose handlers
+  # failed, returns the start of the catch-up window
+  def catch_up(self):
+    self.retry_failed()
+
+    position = self.checkpoint.get(self.subreddit_names)
+    if not self.catchup_enabled or not position:
+      return None
+
+    since = max(position[1] - self.catchup_overlap, time.time() - self.catchup_max_age)
+    missed = fetch_missed_comments(self.subreddit, since, self.catchup_limit)
+    logger.info(f"Catching up on {len(missed)} comments posted since checkpoint {position[0]}")
+    for comment in missed:
+      self.dispatch_comment(comment, since)
+    return since
+
+# !link style commands and the commands.yaml category they search
+link_command_types = {
+  "!link": "link", "!linkme": "link",
+  "!wiki": "wiki", "!faq": "wiki",
+  "!glyph": "glyph", "!glyphs": "glyph",
+  "!app": "app", "!apps": "app",
+  "!toy": "toy", "!toys": "toy",
+}
+
+# command -> handler, every command the bot responds to is registered here
+command_handlers = {
+  "!solved": Bot.handle_solved,
+  "!answer": Bot.handle_answer,
+  "!support": Bot.handle_support,
+  "!bug": Bot.handle_bug,
+  "!bugs": Bot.handle_bug,
+  "!feedback": Bot.handle_bug,
+}
+command_handlers.update({command: Bot.handle_link for command in link_command_types})
+
+# handlers that run for every occurrence of their commands in a comment
+repeatable_handlers = {Bot.handle_link}
+
+# what each handler reads from Reddit beyond the streamed comment, so the async
+# runtime can fetch it up front instead of on first access
+handler_prefetch = {
+  Bot.handle_solved: ("submission",),
+  Bot.handle_answer: ("submission", "parent"),
+  Bot.handle_support: ("parent",),
+  Bot.handle_bug: ("parent",),
+  Bot.handle_link: (),
+}
+
+# one pattern for every command, used both as the pre-filter and to find commands in a comment.
+# Longer commands come first so !linkme isn't matched as !link
+command_pattern = re.compile('|'.join(map(re.escape, sorted(command_handlers, key=len, reverse=True))), re.IGNORECASE)
@@ -0,0 +1,68 @@
+import logging, logging.handlers, os, queue, atexit, time
+from datetime import date
+
+log_format = '%(asctime)s %(levelname)s: %(message)s'
+
+# writes to <directory>/<prefix><date>.log, switching file at midnight and
+# deleting files older than retain_days
+class DailyFileHandler(logging.handlers.BaseRotatingHandler):
+  def __init__(self, directory, prefix, retain_days):
+    self.directory = directory
+    self.prefix = prefix
+    self.retain_days = retain_days
+    self.day = date.today()
+    os.makedirs(directory, exist_ok=True)
+    super().__init__(self._path(self.day), 'a', encoding='utf-8')
+    self._delete_old_files()
+
+  def _path(self, day):
+    return os.path.join(self.directory, f'{self.prefix}{day.strftime("%Y-%m-%d")}.log')
+
+  def shouldRollover(self, record):
+    return date.today() != self.day
+
+  def doRollover(self):
+    if self.stream:
+      self.stream.close()
+      self.stream = None
+    self.day = date.today()
+    self.baseFilename = os.path.abspath(self._path(self.day))
+    self.stream = self._open()
+    self._delete_old_files()
+
+  def _delete_old_files(self):
+    if not self.retain_days:
+      return
+    cutoff = time.time() - self.retain_days * 86400
+    for name in os.listdir(self.directory):
+      if not (name.startswith(self.prefix) and name.endswith('.log')):
+        continue
+      path = os.path.join(self.directory, name)
+      if path != self.baseFilename and os.path.getmtime(path) < cutoff:
+        try:
+          os.remove(path)
+        except OSError:
+          pass
+
+# send all logging through a queue so the terminal and file writes happen on a
+# listener thread, never on the thread handling comments
+def setup_logging(log_level_terminal, log_level_file, retain_days, directory='logs', prefix='log-'):
+  terminal_handler = logging.StreamHandler()
+  terminal_handler.setLevel(log_level_terminal)
+  terminal_handler.setFormatter(logging.Formatter(log_format))
+
+  file_handler = DailyFileHandler(directory, prefix, retain_days)
+  file_handler.setLevel(log_level_file)
+  file_handler.setFormatter(logging.Formatter(log_format))
+
+  log_queue = queue.SimpleQueue()
+  listener = logging.handlers.QueueListener(log_queue, terminal_handler, file_handler, respect_handler_level=True)
+  listener.start()
+  atexit.register(listener.stop)
+
+  logger = logging.getLogger()
+  for handler in list(logger.handlers):
+    logger.removeHandler(handler)
+  logger.addHandler(logging.handlers.QueueHandler(log_queue))
+  logger.setLevel(min(log_level_terminal, log_level_file))
+  return logger
@@ -0,0 +1,137 @@
+# builds and loads the precompiled command catalog
+#
+# commands.yaml is validated and turned into a CommandIndex (normalised
+# aliases, exact-match tables, fuzzy and token search indexes) that is pickled next to it.
+# The bot loads the pickle, which takes milliseconds, and only parses the YAML
+# when the pickle is missing or was built from a different commands.yaml or
+# remove_words list. The pickle is a local build artifact, never downloaded.
+#
+# run from the repo root to validate commands.yaml and rebuild the catalog:
+#   python catalog.py [--check]
+import hashlib, logging, os, pickle, sys, argparse, configparser
+import yaml
+from command_index import CommandIndex
+from normalizer import TextNormalizer
+
+logger = logging.getLogger(__name__)
+
+# bump when CommandIndex changes shape so old artifacts are rebuilt
+catalog_format = 2
+default_artifact_path = "commands.catalog"
+
+# (commands_data without the invalid categories and entries, problems found as readable messages)
+def split_invalid(commands_data):
+  if not isinstance(commands_data, dict):
+    return {}, ["commands.yaml must be a mapping of category to a list of entries"]
+  valid = {}
+  errors = []
+  for category, entries in commands_data.items():
+    if not isinstance(entries, list):
+      errors.append(f"{category}: must be a list of entries")
+      continue
+    valid[category] = []
+    for i, entry in enumerate(entries):
+      where = f"{category}[{i}]"
+      if not isinstance(entry, dict):
+        errors.append(f"{where}: must be a mapping")
+        continue
+      entry_errors = [f"{where}: missing {key}" for key in ("display_name", "link") if not entry.get(key)]
+      if not entry.get("aliases"):
+        entry_errors.append(f"{where} ({entry.get('display_name')}): needs at least one alias")
+      if entry_errors:
+        errors.extend(entry_errors)
+      else:
+        valid[category].append(entry)
+  return valid, errors
+
+# problems with commands.yaml, as readable messages. Empty if it's valid
+def validate_commands(commands_data):
+  return split_invalid(commands_data)[1]
+
+# what an artifact was built from, it's stale if any of this changes
+def catalog_key(source, normalizer):
+  return {
+    "format": catalog_format,
+    "source_sha256": hashlib.sha256(source).hexdigest(),
+    "remove_words": normalizer.remove_words if normalizer else None,
+  }
+
+def build_catalog(commands_path, normalizer, artifact_path=default_artifact_path):
+  with open(commands_path, "rb") as f:
+    source = f.read()
+  # one bad entry shouldn't take down every other command, it's left out until fixed.
+  # catalog.py --check in CI is strict
+  commands_data, errors = split_invalid(yaml.safe_load(source))
+  if not commands_data:
+    raise ValueError(f"{commands_path} has no valid categories: " + "; ".join(errors))
+  for error in errors:
+    logger.error(f"Skipping invalid entry in {commands_path}: {error}")
+
+  catalog = {
+    "key": catalog_key(source, normalizer),
+    "commands_data": commands_data,
+    "index": CommandIndex(commands_data, normalizer),
+  }
+  # written next to the old one and swapped in, so a running bot never reads half a file.
+  # Per process, as shards or query workers starting together may all rebuild it
+  temp_path = f"{artifact_path}.{os.getpid()}.tmp"
+  with open(temp_path, "wb") as f:
+    pickle.dump(catalog, f, protocol=pickle.HIGHEST_PROTOCOL)
+  os.replace(temp_path, artifact_path)
+  logger.info(f"Built {artifact_path} from {commands_path}")
+  return commands_data, catalog["index"]
+
+# (commands_data, CommandIndex) from the artifact, or rebuilt from the YAML if it's stale.
+# If the YAML can't be built at all, the last catalog built is used instead
+def load_catalog(commands_path, normalizer, artifact_path=default_artifact_path):
+  with open(commands_path, "rb") as f:
+    key = catalog_key(f.read(), normalizer)
+  last_good = None
+  try:
+    with open(artifact_path, "rb") as f:
+      catalog = pickle.load(f)
+    if catalog["key"] == key:
+      logger.debug(f"Loaded {artifact_path}")
+      return catalog["commands_data"], catalog["index"]
+    logger.info(f"{artifact_path} is stale, rebuilding from {commands_path}")
+    if catalog["key"]["format"] == catalog_format:
+      last_good = catalog
+  except FileNotFoundError:
+    logger.info(f"No {artifact_path}, building from {commands_path}")
+  except Exception as e:
+    logger.warning(f"Couldn't read {artifact_path}, rebuilding from {commands_path}: {e}")
+
+  try:
+    return build_catalog(commands_path, normalizer, artifact_path)
+  except Exception as e:
+    if last_good is None:
+      raise
+    logger.error(f"Couldn't build a catalog from {commands_path}, using the last one built: {e}")
+    return last_good["commands_data"], last_good["index"]
+
+def main():
+  parser = argparse.ArgumentParser(description="Validate commands.yaml and build the command catalog")
+  parser.add_argument("--commands", default="commands.yaml", help="path to commands.yaml")
+  parser.add_argument("--output", default=default_artifact_path, help="where to write the catalog")
+  parser.add_argument("--config", default="bot_config.txt", help="bot config with the remove_words used to normalise aliases")
+  parser.add_argument("--check", action="store_true", help="only validate commands.yaml")
+  args = parser.parse_args()
+  logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+
+  with open(args.commands, "r") as f:
+    errors = validate_commands(yaml.safe_load(f))
+  for error in errors:
+    print(f"{args.commands}: {error}")
+  if errors:
+    sys.exit(1)
+  if args.check:
+    print(f"{args.commands} is valid")
+    return
+
+  config_parser = configparser.ConfigParser()
+  with open(args.config, "r") as bot_config_file:
+    config_parser.read_string(bot_config_file.read().strip())
+  build_catalog(args.commands, TextNormalizer.from_config(config_parser["bot"]), args.output)
+
+if __name__ == "__main__":
+  main()
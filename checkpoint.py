@@ -0,0 +1,112 @@
+import logging, sqlite3, threading, time
+
+logger = logging.getLogger(__name__)
+
+# persists how far through the comment stream the bot got, and which comments
+# have already been handled, so a restart can catch up without replying twice.
+# Comments whose handlers failed are kept separately so catch-up can retry them
+class StreamCheckpoint:
+  def __init__(self, path, save_interval=5, retain_days=7, prune_interval=3600):
+    self.lock = threading.Lock()
+    self.save_interval = save_interval
+    self.retain_seconds = retain_days * 86400
+    self.prune_interval = prune_interval
+    self.db = sqlite3.connect(path, check_same_thread=False)
+    self.db.execute("PRAGMA journal_mode=WAL")
+    self.db.execute("PRAGMA synchronous=NORMAL")
+    self.db.execute("CREATE TABLE IF NOT EXISTS checkpoint (stream TEXT PRIMARY KEY, fullname TEXT NOT NULL, created_utc REAL NOT NULL)")
+    self.db.execute("CREATE TABLE IF NOT EXISTS processed_comments (id TEXT PRIMARY KEY, created_utc REAL NOT NULL)")
+    self.db.execute("CREATE TABLE IF NOT EXISTS failed_comments (id TEXT PRIMARY KEY, fullname TEXT NOT NULL, created_utc REAL NOT NULL, attempts INTEGER NOT NULL)")
+    self.db.commit()
+
+    # comment ID -> created_utc
+    self.processed = dict(self.db.execute("SELECT id, created_utc FROM processed_comments"))
+    self._prune()
+    self.position = {}
+    self.last_saved = {}
+    for stream, fullname, created_utc in self.db.execute("SELECT stream, fullname, created_utc FROM checkpoint"):
+      self.position[stream] = (fullname, created_utc)
+    logger.debug(f"Loaded checkpoint {self.position} with {len(self.processed)} processed comments")
+
+  # last (fullname, created_utc) seen on the stream, or None on the first run
+  def get(self, stream):
+    return self.position.get(stream)
+
+  # record the newest comment seen, written to disk at most every save_interval seconds
+  def update(self, stream, comment):
+    with self.lock:
+      current = self.position.get(stream)
+      if current and comment.created_utc < current[1]:
+        return
+      self.position[stream] = (comment.fullname, comment.created_utc)
+      if time.monotonic() - self.last_saved.get(stream, 0) >= self.save_interval:
+        self._save(stream)
+
+  def _save(self, stream):
+    fullname, created_utc = self.position[stream]
+    self.db.execute("INSERT OR REPLACE INTO checkpoint (stream, fullname, created_utc) VALUES (?, ?, ?)", (stream, fullname, created_utc))
+    self.db.commit()
+    self.last_saved[stream] = time.monotonic()
+
+  def flush(self):
+    with self.lock:
+      for stream in self.position:
+        self._save(stream)
+
+  # forget comments too old to be caught up again, so the table doesn't grow forever
+  def _prune(self):
+    cutoff = time.time() - self.retain_seconds
+    self.db.execute("DELETE FROM processed_comments WHERE created_utc < ?", (cutoff,))
+    self.db.execute("DELETE FROM failed_comments WHERE created_utc < ?", (cutoff,))
+    self.db.commit()
+    self.processed = {comment_id: created_utc for comment_id, created_utc in self.processed.items() if created_utc >= cutoff}
+    self.last_pruned = time.monotonic()
+
+  def is_processed(self, comment_id):
+    return comment_id in self.processed
+
+  # mark a comment as handled once its handlers have run, returns False if it already was
+  def mark_processed(self, comment):
+    with self.lock:
+      if comment.id in self.processed:
+        return False
+      self.processed[comment.id] = comment.created_utc
+      self.db.execute("INSERT OR IGNORE INTO processed_comments (id, created_utc) VALUES (?, ?)", (comment.id, comment.created_utc))
+      self.db.execute("DELETE FROM failed_comments WHERE id = ?", (comment.id,))
+      if time.monotonic() - self.last_pruned >= self.prune_interval:
+        self._prune()
+      else:
+        self.db.commit()
+      return True
+
+  # a comment's handlers raised, returns how many times they have now failed for it
+  def mark_failed(self, comment):
+    with self.lock:
+      self.db.execute(
+        "INSERT INTO failed_comments (id, fullname, created_utc, attempts) VALUES (?, ?, ?, 1) "
+        "ON CONFLICT(id) DO UPDATE SET attempts = attempts + 1",
+        (comment.id, comment.fullname, comment.created_utc),
+      )
+      self.db.commit()
+      return self.db.execute("SELECT attempts FROM failed_comments WHERE id = ?", (comment.id,)).fetchone()[0]
+
+  # fullnames of the comments waiting to be retried
+  def failed(self):
+    with self.lock:
+      return [row[0] for row in self.db.execute("SELECT fullname FROM failed_comments ORDER BY created_utc")]
+
+# fetch the comments posted since the checkpoint, oldest first
+#
+# the subreddit's comment listing is newest first and PRAW pages through it 100
+# at a time, so this stops as soon as it reaches a comment older than since
+def fetch_missed_comments(subreddit, since, limit=1000):
+  missed = []
+  for comment in subreddit.comments(limit=limit):
+    if comment.created_utc < since:
+      break
+    missed.append(comment)
+  else:
+    if len(missed) >= limit:
+      logger.warning(f"Catch-up reached the listing limit of {limit} comments, older comments may have been missed")
+  missed.reverse()
+  return missed
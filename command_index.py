@@ -0,0 +1,215 @@
+import logging, difflib, heapq, math
+from collections import Counter
+from difflib import SequenceMatcher
+
+logger = logging.getLogger(__name__)
+
+# precompiled lookup tables for commands.yaml, rebuilt whenever the file changes
+#
+# aliases are passed through the same normalizer as command arguments, so the
+# catalog and queries are normalised identically
+class CommandIndex:
+  def __init__(self, commands_data, normalizer=None):
+    # category -> alias -> entry
+    self.exact = {}
+    # category -> alias -> display_name
+    self.display_names = {}
+    # category -> list of aliases in file order (used for suggestions)
+    self.aliases = {}
+    # category -> fuzzy suggestion index over the aliases
+    self.fuzzy = {}
+    # category -> ranked word search over the aliases and display names
+    self.tokens = {}
+
+    for category, entries in (commands_data or {}).items():
+      exact = {}
+      display_names = {}
+      aliases = []
+      # entry position -> normalised aliases and display name, for the token index
+      documents = []
+      for entry in entries or []:
+        texts = [str(entry.get('display_name', '')).lower()]
+        texts.extend(str(alias).lower() for alias in entry.get('aliases', []))
+        documents.append([normalizer.normalize(text) for text in texts] if normalizer else texts)
+        for alias in entry.get('aliases', []):
+          alias = str(alias).lower()
+          if normalizer:
+            alias = normalizer.normalize(alias)
+          # an alias made only of filler words can never be matched
+          if not alias:
+            continue
+          aliases.append(alias)
+          # first entry wins, same as the old linear scan
+          if alias not in exact:
+            exact[alias] = entry
+            display_names[alias] = entry['display_name']
+      self.exact[category] = exact
+      self.display_names[category] = display_names
+      self.aliases[category] = aliases
+      self.fuzzy[category] = FuzzyIndex(aliases)
+      self.tokens[category] = TokenIndex(entries or [], documents)
+
+    sizes = {category: len(exact) for category, exact in self.exact.items()}
+    logger.debug(f"Built command index: {sizes}")
+
+  # return the entry whose aliases contain the argument exactly, or None
+  def lookup(self, category, argument):
+    return self.exact.get(category, {}).get(argument)
+
+  # return the display name for an alias, or None
+  def display_name(self, category, alias):
+    return self.display_names.get(category, {}).get(alias)
+
+  def category_aliases(self, category):
+    return self.aliases.get(category, [])
+
+  # close alias matches for the argument, same results as difflib.get_close_matches
+  def suggest(self, category, argument, n=3, cutoff=0.6, verify=False):
+    fuzzy = self.fuzzy.get(category)
+    if fuzzy is None:
+      return []
+    suggestions = fuzzy.close_matches(argument, n, cutoff)
+
+    if verify:
+      # compatibility mode: run difflib as well and report any difference
+      expected = difflib.get_close_matches(argument, self.category_aliases(category), n=n, cutoff=cutoff)
+      if suggestions != expected:
+        logger.warning(f"Fuzzy index mismatch for {category} '{argument}': {suggestions} vs difflib {expected}")
+        return expected
+
+    return suggestions
+
+  # entries ranked by the words they share with the argument, best first
+  def search(self, category, argument, n=3):
+    tokens = self.tokens.get(category)
+    if tokens is None:
+      return []
+    return tokens.search(argument, n)
+
+# ratio as computed by difflib, so scores compare exactly
+def _ratio(matches, length):
+  return 2.0 * matches / length if length else 1.0
+
+# precomputed alias data for difflib-compatible close matches
+#
+# difflib.get_close_matches runs a SequenceMatcher over every alias. The same
+# upper bounds difflib uses (real_quick_ratio on length, quick_ratio on shared
+# characters) are computed here from a character postings table built once,
+# and candidates are then scored best-bound-first so the full ratio() only runs
+# until the top n can no longer change.
+class FuzzyIndex:
+  def __init__(self, aliases):
+    # duplicates are kept as a count so the results match difflib, which
+    # returns the same alias more than once if it's listed more than once
+    counts = Counter(aliases)
+    self.aliases = list(counts)
+    self.counts = [counts[alias] for alias in self.aliases]
+    self.lengths = [len(alias) for alias in self.aliases]
+    # character -> list of (alias position, number of times in alias)
+    self.postings = {}
+    for position, alias in enumerate(self.aliases):
+      for char, count in Counter(alias).items():
+        self.postings.setdefault(char, []).append((position, count))
+
+  def close_matches(self, word, n=3, cutoff=0.6):
+    if not n > 0:
+      raise ValueError(f"n must be > 0: {n}")
+    if not 0.0 <= cutoff <= 1.0:
+      raise ValueError(f"cutoff must be in [0.0, 1.0]: {cutoff}")
+
+    word_length = len(word)
+    # shared character counts per alias (the quick_ratio numerator)
+    shared = [0] * len(self.aliases)
+    for char, word_count in Counter(word).items():
+      for position, count in self.postings.get(char, ()):
+        shared[position] += count if count < word_count else word_count
+
+    candidates = []
+    for position, alias_length in enumerate(self.lengths):
+      length = alias_length + word_length
+      if _ratio(min(alias_length, word_length), length) < cutoff:
+        continue
+      bound = _ratio(shared[position], length)
+      if bound >= cutoff:
+        candidates.append((bound, position))
+    candidates.sort(reverse=True)
+
+    matcher = SequenceMatcher()
+    matcher.set_seq2(word)
+    result = []
+    # min-heap of the n best scores so far
+    top_scores = []
+    for bound, position in candidates:
+      # ratio can't exceed quick_ratio, so nothing left can enter the top n
+      if len(top_scores) >= n and bound < top_scores[0]:
+        break
+      alias = self.aliases[position]
+      matcher.set_seq1(alias)
+      score = matcher.ratio()
+      if score >= cutoff:
+        for _ in range(self.counts[position]):
+          result.append((score, alias))
+          if len(top_scores) < n:
+            heapq.heappush(top_scores, score)
+          elif score > top_scores[0]:
+            heapq.heapreplace(top_scores, score)
+
+    return [alias for score, alias in heapq.nlargest(n, result)]
+
+# question and pronoun words, common in free text queries but not what they're about.
+# Filler words configured in remove_words are already gone by this point
+stop_words = frozenset(("a", "an", "and", "are", "can", "do", "does", "how", "i", "in", "is", "it", "me", "my", "of", "or", "what", "where", "with", "you", "your"))
+
+# words of a normalised text, with plurals folded so "chargers" finds "charger"
+def tokenize(text):
+  return [word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word for word in text.split() if word not in stop_words]
+
+# BM25 ranked search over each entry's aliases and display name
+#
+# an inverted index from word to the entries using it, so a query only scores
+# the entries sharing at least one word with it. Words that appear in no entry
+# are ignored, so "how do i change the phone charger" is a search for
+# "phone charger". An entry only matches if the words it shares with the query
+# carry at least min_coverage of the query's known words' weight (idf), which
+# keeps one common word in a long query from matching everything
+class TokenIndex:
+  k1 = 1.2
+  b = 0.75
+
+  def __init__(self, entries, documents, min_coverage=0.5):
+    self.entries = list(entries)
+    self.min_coverage = min_coverage
+    # word -> list of (entry position, number of times in the entry)
+    self.postings = {}
+    self.lengths = []
+    for position, texts in enumerate(documents):
+      words = [word for text in texts for word in tokenize(text)]
+      self.lengths.append(len(words))
+      for word, count in Counter(words).items():
+        self.postings.setdefault(word, []).append((position, count))
+    self.average_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+    entry_count = len(self.entries)
+    # word -> inverse document frequency, rare words weigh more
+    self.idf = {word: math.log(1 + (entry_count - len(postings) + 0.5) / (len(postings) + 0.5)) for word, postings in self.postings.items()}
+
+  # the best n entries for a normalised query, as (score, entry)
+  def search(self, query, n=3):
+    words = [word for word in set(tokenize(query)) if word in self.postings]
+    if not words:
+      return []
+    total_weight = sum(self.idf[word] for word in words)
+
+    scores = {}
+    # idf of the query words each entry contains
+    weights = {}
+    for word in words:
+      idf = self.idf[word]
+      for position, count in self.postings[word]:
+        length_norm = 1 - self.b + self.b * self.lengths[position] / self.average_length
+        scores[position] = scores.get(position, 0.0) + idf * count * (self.k1 + 1) / (count + self.k1 * length_norm)
+        weights[position] = weights.get(position, 0.0) + idf
+
+    ranked = [(score, position) for position, score in scores.items() if weights[position] >= self.min_coverage * total_weight]
+    # ties keep file order, like the exact matches
+    ranked.sort(key=lambda item: (-item[0], item[1]))
+    return [(score, self.entries[position]) for score, position in ranked[:n]]
@@ -0,0 +1,115 @@
+import logging, time
+from functools import cached_property
+from metrics import metrics
+from submission_cache import SubmissionInfo
+
+logger = logging.getLogger(__name__)
+
+# everything the command handlers need to know about one comment
+#
+# parent, submission and their authors are resolved lazily and at most once,
+# and every Reddit API call made while handling the comment is counted.
+# Submission details come from the shared submission cache when it has them
+class CommentContext:
+  def __init__(self, comment, permissions, submission_cache=None):
+    self.comment = comment
+    self.permissions = permissions
+    self.submission_cache = submission_cache
+    self.body = comment.body.lower()
+    self.api_calls = 0
+    # responses from the handlers, sent as one reply once they've all run
+    self.responses = []
+
+  # count a call made on behalf of this comment, e.g. a reply or flair change
+  def record_call(self, count=1):
+    self.api_calls += count
+
+  # fetch up front what handlers with these needs will read, see handler_prefetch in bot.py
+  def load(self, needs):
+    if "submission" in needs or ("parent" in needs and self.parent_is_submission):
+      self.submission_info
+    if "parent" in needs and not self.parent_is_submission:
+      self.parent_author
+
+  # read an attribute from a PRAW object, counting the fetch if it isn't loaded yet
+  def _resolve(self, obj, attribute):
+    fetched = getattr(obj, "_fetched", True)
+    start = time.perf_counter()
+    value = getattr(obj, attribute)
+    if not fetched and getattr(obj, "_fetched", True):
+      self.record_call()
+      metrics.observe("bot_reddit_api_seconds", time.perf_counter() - start, kind=f"fetch_{type(obj).__name__.lower()}")
+    return value
+
+  # the comment's author and subreddit come with the streamed data
+  @cached_property
+  def author_name(self):
+    return self.comment.author.name if self.comment.author else None
+
+  @cached_property
+  def subreddit_name(self):
+    return self.comment.subreddit.display_name
+
+  @cached_property
+  def author_is_mod(self):
+    return self.permissions.is_mod(self.subreddit_name, self.author_name)
+
+  @cached_property
+  def author_is_bot(self):
+    return self.permissions.is_bot(self.author_name)
+
+  @cached_property
+  def submission(self):
+    return self.comment.submission
+
+  @cached_property
+  def submission_info(self):
+    if self.submission_cache:
+      info = self.submission_cache.get(self.submission.id)
+      if info:
+        return info
+    author = self._resolve(self.submission, "author")
+    info = SubmissionInfo(
+      author.name if author else None,
+      self.subreddit_name,
+      getattr(self.submission, "link_flair_template_id", None),
+    )
+    if self.submission_cache:
+      self.submission_cache.put(self.submission.id, info)
+    return info
+
+  @cached_property
+  def submission_author_name(self):
+    return self.submission_info.author_name
+
+  @cached_property
+  def author_is_op(self):
+    return bool(self.author_name) and self.author_name.lower() == (self.submission_author_name or "").lower()
+
+  @cached_property
+  def parent(self):
+    return self.comment.parent()
+
+  @cached_property
+  def parent_is_submission(self):
+    # parent_id comes with the streamed data, t3_ is a submission and t1_ a comment
+    return self.comment.parent_id.startswith("t3_")
+
+  @cached_property
+  def parent_author(self):
+    return self._resolve(self.parent, "author")
+
+  @cached_property
+  def parent_author_name(self):
+    # a top level comment's parent is the submission, which may be cached
+    if self.parent_is_submission:
+      return self.submission_author_name
+    return self.parent_author.name if self.parent_author else None
+
+  @cached_property
+  def parent_body(self):
+    return self._resolve(self.parent, "selftext" if self.parent_is_submission else "body")
+
+  @cached_property
+  def parent_permalink(self):
+    return self._resolve(self.parent, "permalink")
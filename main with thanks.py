@@ -1,6 +1,7 @@
-import praw, re, time, json, logging, urllib3, traceback
-import pandas as pd
-from datetime import date, datetime
+import praw, time, json, logging, urllib3, traceback
+from bot_logging import setup_logging
+from support_regex import SupportRegex
+from thanks_store import ThanksStore
 
 #init
 try:
@@ -17,19 +18,19 @@ try:
     thanks_wiki_page_name = config.get('thanks_wiki_page')
     support_regex_match_wiki_page_name = config.get('support_regex_match_wiki_page')
     support_regex_exclude_wiki_page_name = config.get('support_regex_exclude_wiki_page')
+    # seconds between checks for new revisions of the support regex pages
+    support_regex_refresh_interval = config.get('support_regex_refresh_interval', 600)
+    # local thanks store, the leaderboard page is rewritten from it at most every few minutes
+    state_db_path = config.get('state_db_path', 'bot_state.db')
+    thanks_flush_delay = config.get('thanks_flush_delay', 60)
+    thanks_flush_max_delay = config.get('thanks_flush_max_delay', 300)
     bool_send_response = config.get('bool_send_response')
     log_level_terminal = config.get('log_level_terminal')
     log_level_file = config.get('log_level_file')
     log_level_api = config.get('log_level_api')
     log_retain_days = config.get('log_retain_days')
 
-    logging.basicConfig(level=log_level_terminal, format='%(asctime)s %(levelname)s: %(message)s')
-    today = date.today()
-    file_handler = logging.FileHandler(f'logs-{today.strftime("%Y-%m-%d")}.log')
-    file_handler.setLevel(log_level_file)
-    file_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s: %(message)s'))
-    logger = logging.getLogger()
-    logger.addHandler(file_handler)
+    logger = setup_logging(log_level_terminal, log_level_file, log_retain_days, directory='.', prefix='logs-')
 
     logger.debug("Config read")
 
@@ -57,13 +58,13 @@ try:
   subreddit = reddit.subreddit(subreddit_name)
   moderators = subreddit.moderator()
   
-  thanks_wiki_page = subreddit.wiki[thanks_wiki_page_name]
-  thanks_wiki_contents = thanks_wiki_page.content_md
+  thanks_store = ThanksStore(state_db_path, subreddit, thanks_wiki_page_name, thanks_flush_delay, thanks_flush_max_delay)
+  # first run, start from the existing leaderboard
+  if not thanks_store.users:
+    thanks_store.import_leaderboard(subreddit.wiki[thanks_wiki_page_name].content_md)
   
-  support_regex_match_wiki_page = subreddit.wiki[support_regex_match_wiki_page_name]
-  support_regex_exclude_wiki_page = subreddit.wiki[support_regex_exclude_wiki_page_name]
-  support_match_patterns = support_regex_match_wiki_page.content_md.strip().split('\n')
-  support_exclude_patterns = support_regex_exclude_wiki_page.content_md.strip().split('\n')
+  # compiled once and reloaded when the wiki pages get a new revision
+  support_regex = SupportRegex(subreddit, support_regex_match_wiki_page_name, support_regex_exclude_wiki_page_name, support_regex_refresh_interval)
   
   logger.info(f"Init complete: logged in as {reddit_username} monitoring {subreddit_name}")
 except Exception as e:
@@ -127,79 +128,17 @@ def set_flair(user_flair_text, points):
         send_reply(response)
         logger.debug("Thanks added to flair")
 
-# extract the numeric value from the Level column
-def get_level_num(level):
-    if isinstance(level, str):
-        level_num = level.split(" ")[-1]
-        if level_num.isdigit():
-            return int(level_num)
-    return None
-
-# get the wiki leaderboard
-def get_wiki_leaderboard():
-    # split markdown table string into rows
-    rows = thanks_wiki_contents.strip().split("\n")[4:]
-    # split each row into cells
-    cells = [[cell.strip() for cell in row.split("|")[1:-1]] for row in rows]
-    # create a pandas DataFrame from cells
-    df = pd.DataFrame(cells, columns=["Username", "Level", "Last Star Date"])
-    # convert 'Last Star Date' column to datetime type
-    df["Last Star Date"] = pd.to_datetime(df["Last Star Date"]).dt.date
-
-    return df
-
-# set the wiki leaderboard, update or add user, level and date
-def set_wiki_leaderboard(df, user_exists_in_leaderboard, user, points):
-    user = f"u/{user}"
-    today = date.today()
-    if user_exists_in_leaderboard:
-        logger.debug("User located in table, updating existing row")
-        # update the level and date cells on the row matching the username
-        df.loc[df["Username"] == user, "Level"] = f"★ {points}"
-        df.loc[df["Username"] == user, "Last Star Date"] = today.strftime("%Y-%m-%d")
-    else:
-        logger.debug("User not located in table, adding")
-        new_row = {
-            "Username": user,
-            "Level": f"★ {points}",
-            "Last Star Date": today.strftime("%Y-%m-%d"),
-        }
-        df.loc[len(df)] = new_row
-
-    # apply the function to create a new column with the numeric value of the Level column
-    df["Level Num"] = df["Level"].apply(get_level_num)
-    # sort the DataFrame by the Level Num column
-    df = df.sort_values(by=["Level Num", "Last Star Date"], ascending=[False, True])
-    # remove the Level Num column
-    df = df.drop("Level Num", axis=1)
-    # convert DataFrame back to markdown
-    markdown_table = (
-        f"This page is updated by a robot. Do not edit. *Last update*: {today.strftime('%Y-%m-%d')}\n\n" + df.to_markdown(index=False)
-    )
-    # overwrite subreddit wiki page with new markdown
-    subreddit.wiki[thanks_wiki_page_name].edit(content=markdown_table)
-
-# perform actions to thank - get wiki points, handle flair, set flair, set leaderboard
-def thank_user(user):
-  df = get_wiki_leaderboard()
-  user_exists_in_leaderboard = df[df["Username"] == f"u/{user}"]
-  if not user_exists_in_leaderboard.empty:
-      logger.debug(f"User: {user} exists in leaderboard, so incrementing existing points")
-      level = user_exists_in_leaderboard["Level"].iloc[0]
-      last_star_date = user_exists_in_leaderboard["Last Star Date"].iloc[0]
-      points = int(level.split(" ")[-1]) + 1
-  else:
-      logger.debug(f"User: {user} doesn't exist in leaderboard, so points = 1")
-      points = 1
+# perform actions to thank - add the point, handle flair, set flair. The leaderboard is written by thanks_store
+def thank_user(user, submission_id, thanker):
+  points = thanks_store.thank(user.name, submission_id, thanker)
+  logger.debug(f"User: {user} now has {points} points")
   user_flair_text = handle_current_flair(user, points)
-  set_wiki_leaderboard(df, not user_exists_in_leaderboard.empty, user, points)
   set_flair(user_flair_text, points)
 
 while True:
   try:
     # for all comments in the subreddit
     for comment in subreddit.stream.comments(skip_existing=True):
-        file_handler = logging.FileHandler(f'logs-{today.strftime("%Y-%m-%d")}.log')
         logger.info(f"Found comment in {subreddit}, {comment.id} in {comment.submission.id}")
         logger.debug(f"Comment from {comment.author}: {comment.body}")
         # check if the comment is the bot's
@@ -208,17 +147,11 @@ while True:
       
         # check if the comment body matches any of the match patterns if the flair ID = "Support" and the comment is from OP
         if comment.submission.link_flair_template_id == support_flair_template_id and comment.author == comment.submission.author:
-          matched_pattern = None
-          for pattern in support_match_patterns:
-            match = re.search(pattern, comment.body, re.IGNORECASE)
-            if match:
-                matched_pattern = pattern
-                logger.debug(f"Comment matched solved pattern: {matched_pattern}")
-                break
-          
+          matched_pattern = support_regex.match(comment.body)
           if matched_pattern is not None:
+            logger.debug(f"Comment matched solved pattern: {matched_pattern}")
             # check if the comment body does not match any of the excluded patterns
-            if not any(re.search(pattern, comment.body, re.IGNORECASE) for pattern in support_exclude_patterns):
+            if support_regex.excluded(comment.body) is None:
               logger.info("Comment matched potential solved regex, so prompting to mark as solved")
               response = f"It seems like you might've resolved your issue. If so, please update the flair to 'Solved' or reply `!solved`"#\n\nIf you'd like to thank anyone for helping you, reply `!thanks` to *their* comment."
               send_reply(response)
@@ -231,13 +164,12 @@ while True:
           if comment.author in moderators:
               logger.info(f"!thanks giver is a mod: {comment.author.name} in {comment.submission.id}")
               user = reddit.redditor(comment.parent().author.name)
-              #thank_user(user)
+              #thank_user(user, comment.submission.id, comment.author.name)
       
           # check if the submission flair ID = "Support" or "Solved" and that the comment is from OP
           elif (comment.submission.link_flair_template_id == support_flair_template_id or comment.submission.link_flair_template_id == solved_flair_template_id) and comment.author == comment.submission.author:
               user = reddit.redditor(comment.parent().author.name)
               logger.info(f"Found applicable !thanks from {comment.author} in {comment.submission.id}")
-              has_been_thanked = False
 
               # check if the comment author is the same as the parent comment author, OP is replying to themselves
               if comment.parent().author == comment.author:
@@ -260,31 +192,15 @@ while True:
                 send_reply(response)
                 continue
             
-              # get all comments in the thread to check if thanks has already been given to this user
-              submission = comment.submission
-              submission.comments.replace_more(limit=None)
-              logger.debug(f"Checking all comments in thread {comment.submission.id}")
-              for comment_in_submission in submission.comments.list():
-                # check for !thanks from OP
-                if "!thanks" in comment_in_submission.body.lower() and comment_in_submission.author == comment.submission.author:
-                  # get the user who has already been thanked
-                  previously_thanked_user = comment_in_submission.parent().author
-                  # if thanked user is the same as the newly thanked user
-                  if previously_thanked_user == user:
-                    for child_reply in comment_in_submission.replies:
-                      logger.info(f"Found !thanks for {previously_thanked_user} - checking if has been thanked")
-                      # check if there is already a thanks registered by the bot
-                      if child_reply.author == reddit.user.me() and re.search(r"Thanks for .* registered\.", child_reply.body):
-                          has_been_thanked = True
-                          logger.info("!thanks already given in this thread")
-                          break
-                  if has_been_thanked:
-                      break
-                  
+              # check if OP already thanked this user in this thread
+              has_been_thanked = thanks_store.has_thanked(comment.submission.id, comment.author.name, user.name)
+              if has_been_thanked:
+                logger.info("!thanks already given in this thread")
+
               # if they haven't already been thanked
               if not has_been_thanked:
                  logger.info("Doing nothing.")
-                  #thank_user(user)
+                  #thank_user(user, comment.submission.id, comment.author.name)
               else:
                   response = f"You can only thank someone once per thread."
                   send_reply(response)
@@ -0,0 +1,156 @@
+# counters, gauges and latency histograms for the bot, served as Prometheus text
+#
+# like logging, there is one module-level registry (metrics) that any module can
+# record to. Recording is a dict update under a lock, cheap enough for the hot
+# path. Expose it with start_http_server (GET /metrics) or write it to a JSON
+# file every few seconds with start_json_dump
+import json, logging, os, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# seconds, for Reddit API call latency
+default_buckets = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+class Metrics:
+  def __init__(self):
+    self.lock = threading.Lock()
+    # name -> {labels: value}, labels are a sorted tuple of (name, value)
+    self.counters = {}
+    self.gauges = {}
+    # name -> {labels: [bucket counts..., sum, count]}
+    self.histograms = {}
+    self.buckets = {}
+    # name -> function returning the current value, read when metrics are collected
+    self.callbacks = {}
+    self.help = {}
+
+  def describe(self, name, text):
+    self.help[name] = text
+
+  def inc(self, name, amount=1, **labels):
+    key = tuple(sorted(labels.items()))
+    with self.lock:
+      values = self.counters.setdefault(name, {})
+      values[key] = values.get(key, 0) + amount
+
+  def set(self, name, value, **labels):
+    with self.lock:
+      self.gauges.setdefault(name, {})[tuple(sorted(labels.items()))] = value
+
+  # a gauge computed on collection, e.g. a queue depth
+  def gauge_callback(self, name, function):
+    self.callbacks[name] = function
+
+  def observe(self, name, value, buckets=default_buckets, **labels):
+    key = tuple(sorted(labels.items()))
+    with self.lock:
+      bounds = self.buckets.setdefault(name, buckets)
+      values = self.histograms.setdefault(name, {})
+      counts = values.get(key)
+      if counts is None:
+        counts = values[key] = [0] * len(bounds) + [0.0, 0]
+      for i, bound in enumerate(bounds):
+        if value <= bound:
+          counts[i] += 1
+      counts[-2] += value
+      counts[-1] += 1
+
+  # everything as plain data, histograms as count, sum and cumulative buckets
+  def snapshot(self):
+    gauges = {}
+    for name, function in list(self.callbacks.items()):
+      try:
+        gauges[name] = {(): function()}
+      except Exception as e:
+        logger.debug(f"Metric {name} unavailable: {e}")
+    with self.lock:
+      counters = {name: dict(values) for name, values in self.counters.items()}
+      gauges.update({name: dict(values) for name, values in self.gauges.items()})
+      histograms = {name: {key: list(counts) for key, counts in values.items()} for name, values in self.histograms.items()}
+      buckets = dict(self.buckets)
+    return counters, gauges, histograms, buckets
+
+  def prometheus_text(self):
+    counters, gauges, histograms, buckets = self.snapshot()
+    lines = []
+    for kind, metrics in (("counter", counters), ("gauge", gauges)):
+      for name, values in sorted(metrics.items()):
+        self._header(lines, name, kind)
+        for key, value in sorted(values.items()):
+          lines.append(f"{name}{format_labels(key)} {value}")
+    for name, values in sorted(histograms.items()):
+      self._header(lines, name, "histogram")
+      for key, counts in sorted(values.items()):
+        for bound, count in zip(buckets[name], counts):
+          lines.append(f"{name}_bucket{format_labels(key + (('le', bound),))} {count}")
+        lines.append(f"{name}_bucket{format_labels(key + (('le', '+Inf'),))} {counts[-1]}")
+        lines.append(f"{name}_sum{format_labels(key)} {counts[-2]}")
+        lines.append(f"{name}_count{format_labels(key)} {counts[-1]}")
+    return "\n".join(lines) + "\n"
+
+  def _header(self, lines, name, kind):
+    if name in self.help:
+      lines.append(f"# HELP {name} {self.help[name]}")
+    lines.append(f"# TYPE {name} {kind}")
+
+  def as_json(self):
+    counters, gauges, histograms, buckets = self.snapshot()
+    def flatten(values, convert=lambda value: value):
+      return {format_labels(key) or "total": convert(value) for key, value in values.items()}
+    return {
+      "time": time.time(),
+      "counters": {name: flatten(values) for name, values in counters.items()},
+      "gauges": {name: flatten(values) for name, values in gauges.items()},
+      "histograms": {name: flatten(values, lambda counts: {"count": counts[-1], "sum": counts[-2]}) for name, values in histograms.items()},
+    }
+
+def format_labels(key):
+  if not key:
+    return ""
+  return "{" + ",".join(f'{name}="{str(value)}"' for name, value in key) + "}"
+
+metrics = Metrics()
+metrics.describe("bot_comments_seen_total", "Comments read from the stream or catch-up")
+metrics.describe("bot_commands_total", "Commands handled, by command")
+metrics.describe("bot_link_results_total", "link_commands results by type and result (exact, ranked, fuzzy, miss, usage, too_long)")
+metrics.describe("bot_reddit_api_seconds", "Reddit API call latency by kind")
+metrics.describe("bot_stream_lag_seconds", "Seconds between a comment being posted and the bot seeing it")
+metrics.describe("bot_outbound_queue_depth", "Replies and flair changes waiting to be sent")
+metrics.describe("bot_exceptions_total", "Exceptions caught by the main loop and workers, by type")
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+  def do_GET(self):
+    if self.path != "/metrics":
+      self.send_error(404)
+      return
+    body = metrics.prometheus_text().encode()
+    self.send_response(200)
+    self.send_header("Content-Type", "text/plain; version=0.0.4")
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  # scrapes would flood the bot's logs otherwise
+  def log_message(self, format, *args):
+    pass
+
+def start_http_server(port, host=""):
+  server = ThreadingHTTPServer((host, port), _MetricsHandler)
+  threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+  logger.info(f"Serving metrics on port {port}")
+  return server
+
+def start_json_dump(path, interval=60):
+  def dump():
+    while True:
+      time.sleep(interval)
+      temp_path = path + ".tmp"
+      try:
+        with open(temp_path, "w") as metrics_file:
+          json.dump(metrics.as_json(), metrics_file)
+        os.replace(temp_path, path)
+      except OSError as e:
+        logger.warning(f"Failed to write metrics to {path}: {e}")
+  threading.Thread(target=dump, name="metrics-dump", daemon=True).start()
+  logger.info(f"Writing metrics to {path} every {interval}s")
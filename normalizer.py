@@ -0,0 +1,42 @@
+import re, string
+
+# emotes like :) :P etc
+emoticon_pattern = r'[:;=8][-^]?[)D(\]/\\OpP]'
+
+# emoji using unicode ranges
+emoji_pattern = r'[' \
+              u'\U0001F600-\U0001F64F'  \
+              u'\U0001F300-\U0001F5FF'  \
+              u'\U0001F680-\U0001F6FF'  \
+              u'\U0001F1E0-\U0001F1FF'  \
+              u'\U00002700-\U000027BF'  \
+              u'\U0001F900-\U0001F9FF'  \
+              u'\U00002600-\U000026FF'  \
+              ']+'
+
+whitespace_pattern = re.compile(r'\s+')
+
+# normalises command arguments and catalog aliases the same way
+#
+# removes the configured filler words, emoticons, emoji and punctuation in a
+# single pass of one combined pattern, compiled once per config load
+class TextNormalizer:
+  def __init__(self, remove_words):
+    self.remove_words = [word for word in remove_words if word]
+    parts = []
+    if self.remove_words:
+      # only the filler words are case insensitive, like the old separate patterns
+      parts.append(r'(?i:\b(?:' + '|'.join(map(re.escape, self.remove_words)) + r')\b)')
+    parts.append(emoticon_pattern)
+    parts.append(emoji_pattern)
+    parts.append('[' + re.escape(string.punctuation) + ']')
+    self.pattern = re.compile('|'.join(parts))
+
+  def normalize(self, text):
+    text = self.pattern.sub('', text)
+    return whitespace_pattern.sub(' ', text).strip()
+
+  # build from the comma separated remove_words setting in bot_config.txt
+  @classmethod
+  def from_config(cls, config_wiki):
+    return cls(config_wiki['remove_words'].split(', '))
@@ -0,0 +1,245 @@
+import logging, sqlite3, threading, time, json, re, traceback
+import praw, prawcore, requests
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Reddit API errors that won't go away on retry, e.g. replying to a deleted comment or in a locked thread
+permanent_error_types = {"DELETED_COMMENT", "DELETED_LINK", "THREAD_LOCKED", "TOO_OLD"}
+
+# actions that post something new, so retrying one that may have gone through could post it twice
+non_idempotent_kinds = {"reply", "submission_reply"}
+
+# sends replies, stickies and flair changes from a persisted queue on a background thread
+#
+# actions are paced by a token bucket and by the ratelimit Reddit reports on
+# every response, retried with backoff when they fail, and kept in SQLite so
+# anything still pending survives a restart. Flair changes for the same
+# submission are coalesced so only the latest one is sent.
+#
+# an action waiting to be retried only holds back later actions for the same
+# target, everything else carries on. Only a RATELIMIT error or Reddit's
+# reported ratelimit pause the whole queue
+class ActionQueue:
+  # the client library's exceptions, the async runtime uses asyncpraw's
+  api_exception = praw.exceptions.RedditAPIException
+  # the object is gone or the bot can't act on it
+  gone_exceptions = (prawcore.exceptions.Forbidden, prawcore.exceptions.NotFound)
+  # Reddit refused the request, so nothing was posted
+  rejected_exceptions = (praw.exceptions.RedditAPIException, prawcore.exceptions.TooManyRequests)
+  request_exception = prawcore.exceptions.RequestException
+  # network errors from before the request was sent
+  connect_exceptions = (requests.exceptions.ConnectTimeout,)
+
+  def __init__(self, reddit, path, rate=0.5, burst=5, reserve=10, max_attempts=5, backoff=30, start=True):
+    self.reddit = reddit
+    self.rate = rate
+    self.burst = burst
+    self.reserve = reserve
+    self.max_attempts = max_attempts
+    self.backoff = backoff
+    self.tokens = burst
+    self.refilled_at = time.monotonic()
+    # set by a RATELIMIT error, nothing is sent until then
+    self.paused_until = 0
+    self.lock = threading.Lock()
+    self.wake = threading.Event()
+    # the action currently being sent, so it isn't coalesced into mid-send
+    self.sending_id = None
+
+    self.db = sqlite3.connect(path, check_same_thread=False)
+    self.db.execute(
+      "CREATE TABLE IF NOT EXISTS pending_actions ("
+      "id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, target TEXT NOT NULL, "
+      "payload TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, not_before REAL NOT NULL DEFAULT 0)"
+    )
+    self.db.commit()
+
+    pending = self.depth()
+    if pending:
+      logger.info(f"Resuming {pending} pending outbound actions")
+
+    # the async runtime sends from its event loop instead
+    if start:
+      threading.Thread(target=self._run, name="outbound-actions", daemon=True).start()
+
+  # reply to a comment
+  def reply(self, comment_id, text):
+    self._add("reply", comment_id, {"text": text})
+
+  # comment on a submission, optionally distinguished and stickied
+  def submission_reply(self, submission_id, text, sticky=False):
+    self._add("submission_reply", submission_id, {"text": text, "sticky": sticky})
+
+  # change a submission's flair, replacing any change still pending for it
+  def flair(self, submission_id, template_id):
+    with self.lock:
+      row = self.db.execute("SELECT id FROM pending_actions WHERE kind = 'flair' AND target = ? AND id IS NOT ?", (submission_id, self.sending_id)).fetchone()
+      if row:
+        logger.debug(f"Coalescing flair change for {submission_id}")
+        self.db.execute("UPDATE pending_actions SET payload = ? WHERE id = ?", (json.dumps({"template_id": template_id}), row[0]))
+        self.db.commit()
+        return
+    self._add("flair", submission_id, {"template_id": template_id})
+
+  def depth(self):
+    with self.lock:
+      return self.db.execute("SELECT COUNT(*) FROM pending_actions").fetchone()[0]
+
+  def _add(self, kind, target, payload):
+    with self.lock:
+      self.db.execute("INSERT INTO pending_actions (kind, target, payload) VALUES (?, ?, ?)", (kind, target, json.dumps(payload)))
+      self.db.commit()
+    logger.debug(f"Queued {kind} for {target}")
+    self.wake.set()
+
+  # the oldest action that isn't waiting for a retry, or behind one for the same target
+  def _next(self):
+    with self.lock:
+      return self.db.execute(
+        "SELECT id, kind, target, payload, attempts, not_before FROM pending_actions AS action "
+        "WHERE not_before <= ? AND NOT EXISTS (SELECT 1 FROM pending_actions AS earlier WHERE earlier.target = action.target AND earlier.id < action.id) "
+        "ORDER BY id LIMIT 1", (time.time(),)
+      ).fetchone()
+
+  # seconds until the first action waiting for a retry can be sent, or None if nothing is pending.
+  # Actions behind another for the same target are left out, they can't go before it anyway
+  def _next_retry_delay(self):
+    with self.lock:
+      not_before = self.db.execute(
+        "SELECT MIN(not_before) FROM pending_actions AS action "
+        "WHERE NOT EXISTS (SELECT 1 FROM pending_actions AS earlier WHERE earlier.target = action.target AND earlier.id < action.id)"
+      ).fetchone()[0]
+    return None if not_before is None else max(not_before - time.time(), 0)
+
+  # the next action and how many seconds until it can be sent, or (None, seconds until
+  # an action waiting for a retry is due, None if there are none)
+  def _next_ready(self):
+    action = self._next()
+    if not action:
+      return None, self._next_retry_delay()
+    delay = max(self.paused_until - time.time(), self._wait_for_ratelimit(), self._wait_for_token())
+    return action, delay
+
+  def _remove(self, action_id):
+    with self.lock:
+      self.db.execute("DELETE FROM pending_actions WHERE id = ?", (action_id,))
+      self.db.commit()
+
+  # the reply was posted, so if stickying fails only the sticky is retried
+  def _convert_to_sticky(self, action_id, comment_id):
+    with self.lock:
+      self.db.execute("UPDATE pending_actions SET kind = 'sticky', target = ? WHERE id = ?", (comment_id, action_id))
+      self.db.commit()
+
+  def _run(self):
+    while True:
+      action, delay = self._next_ready()
+      if not action:
+        self.wake.wait(delay)
+        self.wake.clear()
+        continue
+      if delay > 0:
+        self.wake.wait(delay)
+        self.wake.clear()
+        continue
+
+      action_id, kind, target, payload, attempts, not_before = action
+      self.tokens -= 1
+      self.sending_id = action_id
+      start = time.perf_counter()
+      try:
+        self._send(action_id, kind, target, json.loads(payload))
+      except Exception as e:
+        self._retry(action_id, kind, target, attempts, e)
+        continue
+      finally:
+        self.sending_id = None
+        metrics.observe("bot_reddit_api_seconds", time.perf_counter() - start, kind=kind)
+
+      self._remove(action_id)
+
+  def _send(self, action_id, kind, target, payload):
+    logger.debug(f"Sending {kind} for {target}")
+    if kind == "reply":
+      self.reddit.comment(target).reply(payload["text"])
+    elif kind == "submission_reply":
+      new_comment = self.reddit.submission(target).reply(payload["text"])
+      if payload["sticky"]:
+        self._convert_to_sticky(action_id, new_comment.id)
+        new_comment.mod.distinguish(sticky=True)
+    elif kind == "sticky":
+      self.reddit.comment(target).mod.distinguish(sticky=True)
+    elif kind == "flair":
+      self.reddit.submission(target).flair.select(payload["template_id"])
+    else:
+      logger.error(f"Unknown outbound action {kind}, dropping it")
+
+  def _retry(self, action_id, kind, target, attempts, error):
+    attempts += 1
+    if self._is_permanent(error):
+      logger.error(f"Dropping {kind} for {target}, Reddit won't accept it: {error}")
+      self._remove(action_id)
+      return
+    if kind in non_idempotent_kinds and not self._failed_before_sending(error):
+      logger.error(f"Dropping {kind} for {target}, it may have been posted so isn't retried: {error}")
+      self._remove(action_id)
+      return
+    if attempts >= self.max_attempts:
+      logger.error(f"Giving up on {kind} for {target} after {attempts} attempts: {error}")
+      traceback.print_exc()
+      self._remove(action_id)
+      return
+
+    delay = ratelimit_delay(error, self.api_exception)
+    if delay:
+      # every action counts against the same ratelimit
+      self.paused_until = time.time() + delay
+    else:
+      delay = self.backoff * 2 ** (attempts - 1)
+    logger.warning(f"Failed to send {kind} for {target} (attempt {attempts}), retrying in {delay}s: {error}")
+    with self.lock:
+      self.db.execute("UPDATE pending_actions SET attempts = ?, not_before = ? WHERE id = ?", (attempts, time.time() + delay, action_id))
+      self.db.commit()
+
+  def _is_permanent(self, error):
+    if isinstance(error, self.gone_exceptions):
+      return True
+    return isinstance(error, self.api_exception) and any(item.error_type in permanent_error_types for item in error.items)
+
+  # whether the request certainly never reached Reddit or was refused, so a reply can be retried safely
+  def _failed_before_sending(self, error):
+    if isinstance(error, self.rejected_exceptions):
+      return True
+    return isinstance(error, self.request_exception) and isinstance(error.original_exception, self.connect_exceptions)
+
+  # seconds until a token is available
+  def _wait_for_token(self):
+    now = time.monotonic()
+    self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate)
+    self.refilled_at = now
+    if self.tokens >= 1:
+      return 0
+    return (1 - self.tokens) / self.rate
+
+  # seconds until Reddit's ratelimit window resets, if nearly used up
+  def _wait_for_ratelimit(self):
+    limits = self.reddit.auth.limits
+    remaining = limits.get("remaining")
+    reset_timestamp = limits.get("reset_timestamp")
+    if remaining is None or reset_timestamp is None or remaining > self.reserve:
+      return 0
+    return max(reset_timestamp - time.time(), 0)
+
+# seconds Reddit asked us to wait in a RATELIMIT error, or None
+def ratelimit_delay(error, exception_type=praw.exceptions.RedditAPIException):
+  if not isinstance(error, exception_type):
+    return None
+  for item in error.items:
+    if item.error_type != "RATELIMIT":
+      continue
+    match = re.search(r"(\d+) (minute|second)", item.message)
+    if match:
+      return int(match.group(1)) * (60 if match.group(2) == "minute" else 1) + 1
+    return 60
+  return None
@@ -0,0 +1,98 @@
+import logging, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# caches the bot's own username and the moderators of each subreddit
+#
+# moderators are stored per subreddit as frozensets of lowercase names and
+# refreshed in the background, so newly added mods work without a restart.
+# With a snapshot, startup uses the last known moderators and fetches in the background
+class PermissionsCache:
+  def __init__(self, reddit, subreddit_names, refresh_interval=3600, snapshot=None):
+    self.reddit = reddit
+    self.subreddit_names = subreddit_names
+    self.refresh_interval = refresh_interval
+    self.snapshot = snapshot
+    # lowercase subreddit name -> frozenset of lowercase moderator names
+    self.moderators = {}
+
+    if self._load_snapshot():
+      threading.Thread(target=self._refresh_loop, args=(True,), name="permissions-refresh", daemon=True).start()
+      return
+
+    self.bot_username = reddit.user.me().name
+    self.bot_username_lower = self.bot_username.lower()
+    # fail at startup if the moderators can't be fetched
+    self.refresh(raise_errors=True)
+
+    if refresh_interval > 0:
+      threading.Thread(target=self._refresh_loop, name="permissions-refresh", daemon=True).start()
+
+  # use the snapshot if it was saved by the same account and covers every subreddit
+  def _load_snapshot(self):
+    cached = self.snapshot.get("permissions") if self.snapshot else None
+    if not cached:
+      return False
+    username = getattr(getattr(self.reddit, "config", None), "username", None)
+    if username and username.lower() != cached["bot_username"].lower():
+      return False
+    if not {name.lower() for name in self.subreddit_names} <= set(cached["moderators"]):
+      return False
+
+    self.bot_username = cached["bot_username"]
+    self.bot_username_lower = self.bot_username.lower()
+    self.moderators = {name: frozenset(mods) for name, mods in cached["moderators"].items()}
+    logger.info(f"Loaded moderators for {len(self.moderators)} subreddits from the snapshot, refreshing in the background")
+    return True
+
+  def _fetch_moderators(self, subreddit_name):
+    start = time.perf_counter()
+    try:
+      return frozenset(mod.name.lower() for mod in self.reddit.subreddit(subreddit_name).moderator())
+    except Exception as e:
+      logger.error(f"Failed to get moderators for {subreddit_name}: {e}")
+      return e
+    finally:
+      metrics.observe("bot_reddit_api_seconds", time.perf_counter() - start, kind="moderators")
+
+  def refresh(self, raise_errors=False):
+    # one request per subreddit, made at the same time
+    with ThreadPoolExecutor(max_workers=min(len(self.subreddit_names), 8) or 1, thread_name_prefix="moderators") as executor:
+      results = list(executor.map(self._fetch_moderators, self.subreddit_names))
+
+    for subreddit_name, moderators in zip(self.subreddit_names, results):
+      if isinstance(moderators, Exception):
+        if raise_errors:
+          raise moderators
+        # keep the last known moderators
+        continue
+
+      previous = self.moderators.get(subreddit_name.lower())
+      # replace the whole set so readers never see a partial update
+      self.moderators[subreddit_name.lower()] = moderators
+      if previous is not None and previous != moderators:
+        logger.info(f"Moderators changed for {subreddit_name}: added {sorted(moderators - previous)}, removed {sorted(previous - moderators)}")
+      logger.debug(f"Subreddit: {subreddit_name} moderators: {sorted(moderators)}")
+
+    if self.snapshot:
+      self.snapshot.set("permissions", {
+        "bot_username": self.bot_username,
+        "moderators": {name: sorted(mods) for name, mods in self.moderators.items()},
+      })
+
+  def _refresh_loop(self, refresh_now=False):
+    if refresh_now:
+      self.refresh()
+    while self.refresh_interval > 0:
+      time.sleep(self.refresh_interval)
+      self.refresh()
+
+  def is_mod(self, subreddit_name, username):
+    if not username:
+      return False
+    return username.lower() in self.moderators.get(subreddit_name.lower(), frozenset())
+
+  def is_bot(self, username):
+    return bool(username) and username.lower() == self.bot_username_lower
@@ -0,0 +1,80 @@
+import logging, queue, threading, time, traceback, zlib
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# reads comments from a single stream and hands them to a pool of worker threads
+#
+# each worker has its own bounded queue and comments are routed by submission,
+# so commands in the same thread (e.g. !answer then !solved) are handled in the
+# order they were posted while other threads are handled in parallel
+class CommentPipeline:
+  def __init__(self, handler, workers=4, queue_size=100, stats_interval=60):
+    self.handler = handler
+    self.workers = workers
+    self.stats_interval = stats_interval
+    self.queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+    self.stats_lock = threading.Lock()
+    self._reset_stats()
+
+    for worker_id in range(workers):
+      threading.Thread(target=self._worker, args=(worker_id,), name=f"comment-worker-{worker_id}", daemon=True).start()
+    threading.Thread(target=self._log_stats, name="comment-pipeline-stats", daemon=True).start()
+
+    logger.info(f"Comment pipeline started with {workers} workers and queue size {queue_size}")
+
+  # queue a comment for processing, blocks while that worker's queue is full
+  def submit(self, comment, key):
+    worker_id = zlib.crc32(key.encode()) % self.workers
+    self.queues[worker_id].put((comment, time.monotonic()))
+
+  def depths(self):
+    return [q.qsize() for q in self.queues]
+
+  def _worker(self, worker_id):
+    comments = self.queues[worker_id]
+    while True:
+      comment, queued_at = comments.get()
+      started_at = time.monotonic()
+      try:
+        self.handler(comment)
+      except Exception as e:
+        metrics.inc("bot_exceptions_total", type=type(e).__name__)
+        logger.error(f"Worker {worker_id} encountered an exception: {e}")
+        traceback.print_exc()
+      finally:
+        finished_at = time.monotonic()
+        self._record(started_at - queued_at, finished_at - started_at)
+        comments.task_done()
+
+  def _reset_stats(self):
+    self.processed = 0
+    self.wait_total = 0.0
+    self.wait_max = 0.0
+    self.handle_total = 0.0
+    self.handle_max = 0.0
+
+  def _record(self, wait, handle):
+    with self.stats_lock:
+      self.processed += 1
+      self.wait_total += wait
+      self.wait_max = max(self.wait_max, wait)
+      self.handle_total += handle
+      self.handle_max = max(self.handle_max, handle)
+
+  # periodically log queue depth and per-stage latency
+  def _log_stats(self):
+    while True:
+      time.sleep(self.stats_interval)
+      with self.stats_lock:
+        processed = self.processed
+        wait_avg = self.wait_total / processed if processed else 0.0
+        handle_avg = self.handle_total / processed if processed else 0.0
+        wait_max = self.wait_max
+        handle_max = self.handle_max
+        self._reset_stats()
+      logger.info(
+        f"Pipeline: {self.workers} workers, queue depths {self.depths()}, {processed} comments in the last {self.stats_interval}s, "
+        f"queue wait avg {wait_avg * 1000:.1f}ms max {wait_max * 1000:.1f}ms, "
+        f"handling avg {handle_avg * 1000:.1f}ms max {handle_max * 1000:.1f}ms"
+      )
@@ -0,0 +1,37 @@
+import json, logging, os, threading
+
+logger = logging.getLogger(__name__)
+
+# last known good copies of what the bot fetches at startup (moderators, wiki pages)
+#
+# startup loads from here so the stream can begin straight away, and the
+# background refreshes write back whenever a fetch succeeds. The file is
+# replaced atomically so a crash mid-write never leaves it half written
+class Snapshot:
+  def __init__(self, path):
+    self.path = path
+    self.lock = threading.Lock()
+    self.data = {}
+    try:
+      with open(path, 'r') as snapshot_file:
+        self.data = json.load(snapshot_file)
+      logger.debug(f"Loaded startup snapshot {path} with {sorted(self.data)}")
+    except FileNotFoundError:
+      logger.info(f"No startup snapshot at {path}, fetching everything")
+    except (OSError, ValueError) as e:
+      logger.warning(f"Ignoring unreadable startup snapshot {path}: {e}")
+
+  def get(self, key):
+    with self.lock:
+      return self.data.get(key)
+
+  def set(self, key, value):
+    with self.lock:
+      self.data[key] = value
+      temp_path = self.path + '.tmp'
+      try:
+        with open(temp_path, 'w') as snapshot_file:
+          json.dump(self.data, snapshot_file)
+        os.replace(temp_path, self.path)
+      except OSError as e:
+        logger.warning(f"Failed to save startup snapshot {self.path}: {e}")
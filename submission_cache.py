@@ -0,0 +1,60 @@
+import logging, threading, time
+from collections import OrderedDict, namedtuple
+
+logger = logging.getLogger(__name__)
+
+# what the handlers need to know about a submission
+SubmissionInfo = namedtuple("SubmissionInfo", ["author_name", "subreddit_name", "flair_template_id"])
+
+# recently seen submissions, so comments in a busy thread don't each fetch it
+#
+# bounded LRU with a TTL, since a submission's flair can be changed by its
+# author or a mod at any time. The bot invalidates a submission when it changes the flair
+class SubmissionCache:
+  def __init__(self, max_size=1000, ttl=600, log_every=1000):
+    self.max_size = max_size
+    self.ttl = ttl
+    self.log_every = log_every
+    self.lock = threading.Lock()
+    # submission ID -> (SubmissionInfo, monotonic time it was cached)
+    self.entries = OrderedDict()
+    self.hits = 0
+    self.misses = 0
+
+  def get(self, submission_id):
+    with self.lock:
+      entry = self.entries.get(submission_id)
+      if entry and time.monotonic() - entry[1] < self.ttl:
+        self.entries.move_to_end(submission_id)
+        self.hits += 1
+        info = entry[0]
+      else:
+        if entry:
+          del self.entries[submission_id]
+        self.misses += 1
+        info = None
+      lookups = self.hits + self.misses
+    if lookups % self.log_every == 0:
+      self.log_stats()
+    return info
+
+  def put(self, submission_id, info):
+    with self.lock:
+      # don't overwrite a newer entry, e.g. a flair change made while this was fetched
+      if submission_id in self.entries:
+        return
+      self.entries[submission_id] = (info, time.monotonic())
+      if len(self.entries) > self.max_size:
+        self.entries.popitem(last=False)
+
+  # the bot changed the flair itself, so update the cached copy instead of fetching again
+  def invalidate(self, submission_id):
+    with self.lock:
+      self.entries.pop(submission_id, None)
+
+  def log_stats(self):
+    with self.lock:
+      lookups = self.hits + self.misses
+      ratio = self.hits / lookups if lookups else 0.0
+      size = len(self.entries)
+    logger.info(f"Submission cache: {size}/{self.max_size} entries, {lookups} lookups, {ratio:.1%} hits")
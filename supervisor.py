@@ -0,0 +1,156 @@
+# runs the bot as several processes, each streaming its own share of the subreddits
+#
+#   python supervisor.py [--shards 2]
+#
+# the subreddits in config.json are split round-robin into shards and each
+# shard runs main.py with its own subreddit list, state database, snapshot and
+# log files, passed in BOT_CONFIG_OVERRIDES. Metrics are served on
+# metrics_port + shard number and written to a JSON file per shard.
+# outbound_rate is divided between the shards since they share the account's ratelimit. A shard that exits or
+# stops writing its heartbeat is restarted, backing off if it keeps failing.
+# Solved flair templates and moderators are per subreddit, so they work unchanged
+import os, sys, json, time, asyncio, logging, argparse, subprocess, threading
+from bot_logging import setup_logging
+
+logger = logging.getLogger(__name__)
+
+# lets the supervisor see that a shard is still running
+#
+# written on a timer rather than from the stream loop, which would need
+# pause_after=0 and so lose PRAW's backoff between empty polls
+class Heartbeat:
+  def __init__(self, path, interval=10):
+    self.path = path
+    self.interval = interval
+
+  def beat(self):
+    with open(self.path, 'w') as heartbeat_file:
+      heartbeat_file.write(str(time.time()))
+
+  # writes the heartbeat from a background thread, if there's a path to write to
+  def start(self):
+    if self.path:
+      threading.Thread(target=self._run, name="heartbeat", daemon=True).start()
+
+  def _run(self):
+    while True:
+      self.beat()
+      time.sleep(self.interval)
+
+  # for the async runtime, so the heartbeat also stops if the event loop is blocked
+  async def run(self):
+    while True:
+      self.beat()
+      await asyncio.sleep(self.interval)
+
+# subreddit names split round-robin into at most shard_count groups
+def shard_subreddits(subreddit_names, shard_count):
+  names = [name for name in subreddit_names.replace(' ', '').split('+') if name]
+  return [names[i::shard_count] for i in range(min(shard_count, len(names)))]
+
+# e.g. metrics.json -> metrics-shard1.json
+def shard_path(path, shard_id):
+  root, extension = os.path.splitext(path)
+  return f"{root}-shard{shard_id}{extension}"
+
+class Shard:
+  def __init__(self, shard_id, subreddits, config, shard_count):
+    self.shard_id = shard_id
+    self.subreddits = subreddits
+    self.overrides = {
+      "subreddit": '+'.join(subreddits),
+      "state_db_path": f"bot_state-shard{shard_id}.db",
+      "snapshot_path": f"bot_snapshot-shard{shard_id}.json",
+      "heartbeat_path": f"bot_heartbeat-shard{shard_id}",
+      "log_prefix": f"log-shard{shard_id}-",
+      "outbound_rate": config.get('outbound_rate', 0.5) / shard_count,
+      # each shard needs its own port and file
+      "metrics_port": config['metrics_port'] + shard_id if config.get('metrics_port') else 0,
+      "metrics_json_path": shard_path(config['metrics_json_path'], shard_id) if config.get('metrics_json_path') else None,
+    }
+    self.process = None
+    self.started_at = 0
+    self.failures = 0
+    self.restart_at = 0
+
+  def start(self):
+    env = dict(os.environ, BOT_CONFIG_OVERRIDES=json.dumps(self.overrides))
+    # a heartbeat left over from the previous run doesn't count
+    try:
+      os.remove(self.overrides["heartbeat_path"])
+    except FileNotFoundError:
+      pass
+    self.process = subprocess.Popen([sys.executable, 'main.py'], env=env, stdin=subprocess.DEVNULL)
+    self.started_at = time.monotonic()
+    logger.info(f"Started shard {self.shard_id} (pid {self.process.pid}) for {self.overrides['subreddit']}")
+
+  # seconds since the last heartbeat, or since start if there hasn't been one yet
+  def heartbeat_age(self):
+    try:
+      return time.time() - os.path.getmtime(self.overrides["heartbeat_path"])
+    except FileNotFoundError:
+      return time.monotonic() - self.started_at
+
+  def stop(self):
+    if self.process and self.process.poll() is None:
+      self.process.terminate()
+      try:
+        self.process.wait(timeout=30)
+      except subprocess.TimeoutExpired:
+        self.process.kill()
+        self.process.wait()
+
+def main():
+  parser = argparse.ArgumentParser(description="Run the bot as one process per shard of subreddits")
+  parser.add_argument("--shards", type=int, help="number of worker processes, defaults to shards in config.json")
+  args = parser.parse_args()
+
+  with open('config.json', 'r') as config_file:
+    config = json.load(config_file)
+  shard_count = args.shards or config.get('shards', 2)
+  # seconds without a heartbeat before a shard is restarted
+  heartbeat_timeout = config.get('shard_heartbeat_timeout', 600)
+  # a shard that ran this long before failing starts its backoff again
+  healthy_after = config.get('shard_healthy_after', 600)
+  max_backoff = config.get('shard_max_backoff', 300)
+
+  setup_logging(config['log_level_terminal'], config['log_level_file'], config['log_retain_days'], prefix='supervisor-')
+  if config.get('twofa_enabled'):
+    logger.error("Shards can't prompt for a 2FA token, set twofa_enabled to false to use the supervisor")
+    sys.exit(1)
+
+  shards = [Shard(shard_id, subreddits, config, shard_count) for shard_id, subreddits in enumerate(shard_subreddits(config['subreddit'], shard_count))]
+  for shard in shards:
+    shard.start()
+
+  try:
+    while True:
+      time.sleep(5)
+      for shard in shards:
+        if shard.process is None:
+          if time.monotonic() >= shard.restart_at:
+            shard.start()
+          continue
+
+        exit_code = shard.process.poll()
+        if exit_code is None and shard.heartbeat_age() > heartbeat_timeout:
+          logger.error(f"Shard {shard.shard_id} has no heartbeat for {shard.heartbeat_age():.0f}s, restarting it")
+          shard.stop()
+          exit_code = shard.process.returncode
+        if exit_code is None:
+          continue
+
+        if time.monotonic() - shard.started_at >= healthy_after:
+          shard.failures = 0
+        shard.failures += 1
+        delay = min(5 * 2 ** (shard.failures - 1), max_backoff)
+        logger.error(f"Shard {shard.shard_id} exited with code {exit_code}, restarting in {delay}s")
+        shard.process = None
+        shard.restart_at = time.monotonic() + delay
+  except KeyboardInterrupt:
+    logger.info("Stopping shards")
+    for shard in shards:
+      shard.stop()
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,137 @@
+import logging, re, threading, time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# the support "solved" match and exclude patterns from the wiki
+#
+# each set is compiled into one alternation, so a comment without a match (most
+# of them) is searched once per set. When the alternation matches, the patterns
+# are tried in wiki order to find the first one that matches, which is the
+# pattern returned and counted, same as searching them one by one. Pages are
+# re-downloaded only when their latest revision changes
+class SupportRegex:
+  def __init__(self, subreddit, match_page_name, exclude_page_name, refresh_interval=600):
+    self.subreddit = subreddit
+    self.page_names = {"match": match_page_name, "exclude": exclude_page_name}
+    self.refresh_interval = refresh_interval
+    # page kind -> latest revision ID that was compiled
+    self.revisions = {}
+    # page kind -> (combined pattern or None, list of patterns)
+    self.compiled = {"match": (None, []), "exclude": (None, [])}
+    # pattern -> number of comments it matched, for tuning the wiki pages
+    self.hits = {"match": Counter(), "exclude": Counter()}
+    self.hits_lock = threading.Lock()
+
+    # fail at startup if the pages can't be fetched
+    self.refresh(raise_errors=True)
+
+    if refresh_interval > 0:
+      threading.Thread(target=self._refresh_loop, name="support-regex-refresh", daemon=True).start()
+
+  def _latest_revision(self, page_name):
+    for revision in self.subreddit.wiki[page_name].revisions(limit=1):
+      return revision["id"]
+    return None
+
+  # the page's patterns if it has a new revision, None if unchanged, or the exception
+  def _fetch_page(self, kind):
+    page_name = self.page_names[kind]
+    try:
+      revision = self._latest_revision(page_name)
+      if revision is not None and revision == self.revisions.get(kind):
+        logger.debug(f"Wiki page {page_name} unchanged at revision {revision}")
+        return None
+      return revision, self.subreddit.wiki[page_name].content_md.strip().split('\n')
+    except Exception as e:
+      logger.error(f"Failed to get wiki page {page_name}: {e}")
+      return e
+
+  def refresh(self, raise_errors=False):
+    # both pages are checked at the same time
+    with ThreadPoolExecutor(max_workers=len(self.page_names), thread_name_prefix="support-regex") as executor:
+      results = dict(zip(self.page_names, executor.map(self._fetch_page, self.page_names)))
+
+    for kind, result in results.items():
+      if isinstance(result, Exception):
+        if raise_errors:
+          raise result
+        # keep the last compiled patterns
+        continue
+      if result is None:
+        continue
+
+      revision, patterns = result
+      # replace the whole tuple so readers never see a partial update
+      self.compiled[kind] = compile_patterns(patterns)
+      self.revisions[kind] = revision
+      logger.info(f"Compiled {len(self.compiled[kind][1])} {kind} patterns from {self.page_names[kind]} (revision {revision})")
+
+  def _refresh_loop(self):
+    while self.refresh_interval > 0:
+      time.sleep(self.refresh_interval)
+      self.refresh()
+      self.log_hits()
+
+  def _search(self, kind, text):
+    combined, patterns = self.compiled[kind]
+    matched = None
+    if combined is not None:
+      # the leftmost match may be from a later pattern, so the one reported is found in order
+      if combined.search(text):
+        matched = next((pattern.pattern for pattern in patterns if pattern.search(text)), None)
+    else:
+      # a pattern that can't be combined (e.g. it uses backreferences), search them one at a time
+      for pattern in patterns:
+        if pattern.search(text):
+          matched = pattern.pattern
+          break
+
+    if matched is not None:
+      with self.hits_lock:
+        self.hits[kind][matched] += 1
+    return matched
+
+  # the match pattern found in the text, or None
+  def match(self, text):
+    return self._search("match", text)
+
+  # the exclude pattern found in the text, or None
+  def excluded(self, text):
+    return self._search("exclude", text)
+
+  # a copy of the hit counters, pattern -> comments matched
+  def hit_counts(self):
+    with self.hits_lock:
+      return {kind: dict(hits) for kind, hits in self.hits.items()}
+
+  def log_hits(self):
+    for kind, hits in self.hit_counts().items():
+      if hits:
+        logger.info(f"Support {kind} pattern hits: {sorted(hits.items(), key=lambda item: -item[1])}")
+
+# compile a list of pattern strings into one case insensitive alternation.
+# Returns (combined or None, individually compiled patterns)
+def compile_patterns(patterns):
+  compiled = []
+  for pattern in patterns:
+    pattern = pattern.strip()
+    if not pattern:
+      continue
+    try:
+      compiled.append(re.compile(pattern, re.IGNORECASE))
+    except re.error as e:
+      logger.error(f"Skipping invalid support pattern {pattern!r}: {e}")
+
+  combined = None
+  if compiled:
+    try:
+      combined = re.compile('|'.join(f"(?:{pattern.pattern})" for pattern in compiled), re.IGNORECASE)
+      # numbered backreferences inside a pattern would now refer to the wrong group
+      if any(re.search(r'\\\d', pattern.pattern) for pattern in compiled):
+        combined = None
+    except re.error as e:
+      logger.warning(f"Support patterns can't be combined, searching them one at a time: {e}")
+      combined = None
+  return combined, compiled
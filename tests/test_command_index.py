@@ -0,0 +1,50 @@
+# FuzzyIndex must return exactly what difflib.get_close_matches would, in the same order
+import os, sys, random, difflib, configparser
+import pytest
+import yaml
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+from command_index import CommandIndex
+from normalizer import TextNormalizer
+
+@pytest.fixture(scope="module")
+def index():
+  config_parser = configparser.ConfigParser()
+  with open(os.path.join(root, 'bot_config.txt'), 'r') as bot_config_file:
+    config_parser.read_string(bot_config_file.read().strip())
+  with open(os.path.join(root, 'commands.yaml'), 'r') as f:
+    commands_data = yaml.safe_load(f)
+  return CommandIndex(commands_data, TextNormalizer.from_config(config_parser['bot']))
+
+# deletions, insertions, substitutions and swaps of every alias, plus some unrelated words
+def typos(aliases, seed=1):
+  random.seed(seed)
+  letters = "abcdefghijklmnopqrstuvwxyz0123456789 "
+  queries = ["", "a", "zzz", "phone", "glyph", "nothing phone", "how do i change the charger"]
+  for alias in aliases:
+    queries.append(alias)
+    position = random.randrange(len(alias))
+    queries.append(alias[:position] + alias[position + 1:])
+    queries.append(alias[:position] + random.choice(letters) + alias[position:])
+    queries.append(alias[:position] + random.choice(letters) + alias[position + 1:])
+    if position < len(alias) - 1:
+      queries.append(alias[:position] + alias[position + 1] + alias[position] + alias[position + 2:])
+  return queries
+
+@pytest.mark.parametrize("category", ["wiki", "app", "link", "glyph", "toy"])
+@pytest.mark.parametrize("n, cutoff", [(3, 0.6), (1, 0.6), (5, 0.4), (3, 0.8), (3, 0.0), (3, 1.0)])
+def test_suggest_matches_difflib(index, category, n, cutoff):
+  aliases = index.category_aliases(category)
+  for query in typos(aliases):
+    expected = difflib.get_close_matches(query, aliases, n=n, cutoff=cutoff)
+    assert index.suggest(category, query, n=n, cutoff=cutoff) == expected, query
+
+def test_suggest_unknown_category(index):
+  assert index.suggest("missing", "phone") == []
+
+def test_suggest_rejects_bad_arguments(index):
+  with pytest.raises(ValueError):
+    index.suggest("wiki", "phone", n=0)
+  with pytest.raises(ValueError):
+    index.suggest("wiki", "phone", cutoff=1.5)
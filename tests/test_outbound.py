@@ -0,0 +1,82 @@
+# ActionQueue ordering and retry delays, against a fake Reddit that fails on request
+import os, sys, json, time, types
+import pytest
+import prawcore, requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from outbound import ActionQueue
+
+class FakeSubmission:
+  def __init__(self, reddit, id):
+    self.reddit = reddit
+    self.id = id
+    self.flair = types.SimpleNamespace(select=lambda template_id: self.send("flair"))
+
+  def send(self, kind):
+    if self.reddit.failures:
+      raise self.reddit.failures.pop(0)
+    self.reddit.sent.append((kind, self.id))
+
+  def reply(self, text):
+    self.send("submission_reply")
+    return types.SimpleNamespace(id="c_" + self.id, mod=types.SimpleNamespace(distinguish=lambda sticky: None))
+
+class FakeReddit:
+  def __init__(self, failures=()):
+    self.auth = types.SimpleNamespace(limits={})
+    self.failures = list(failures)
+    self.sent = []
+
+  def submission(self, id):
+    return FakeSubmission(self, id)
+
+def connect_timeout():
+  return prawcore.exceptions.RequestException(requests.exceptions.ConnectTimeout(), (), {})
+
+# one pass of ActionQueue._run, without the waiting
+def send_next(queue):
+  action, delay = queue._next_ready()
+  action_id, kind, target, payload, attempts, not_before = action
+  try:
+    queue._send(action_id, kind, target, json.loads(payload))
+  except Exception as e:
+    queue._retry(action_id, kind, target, attempts, e)
+    return
+  queue._remove(action_id)
+
+def test_blocked_action_waits_for_the_retry_before_it():
+  reddit = FakeReddit([connect_timeout()])
+  queue = ActionQueue(reddit, ":memory:", rate=100, burst=100, backoff=30, start=False)
+  queue.submission_reply("s1", "x")
+  queue.flair("s1", "t")
+  send_next(queue)
+
+  # the flair is due now but behind the reply, which is waiting out its backoff
+  action, delay = queue._next_ready()
+  assert action is None
+  assert delay == pytest.approx(30, abs=1)
+
+def test_other_targets_are_not_held_back():
+  reddit = FakeReddit([connect_timeout()])
+  queue = ActionQueue(reddit, ":memory:", rate=100, burst=100, backoff=30, start=False)
+  queue.submission_reply("s1", "x")
+  queue.flair("s1", "t")
+  queue.flair("s2", "t")
+  send_next(queue)
+
+  action, delay = queue._next_ready()
+  assert action[2] == "s2"
+  assert delay == 0
+
+def test_blocked_action_is_sent_after_the_retry():
+  reddit = FakeReddit([connect_timeout()])
+  queue = ActionQueue(reddit, ":memory:", rate=100, burst=100, backoff=0.2, start=False)
+  queue.submission_reply("s1", "x")
+  queue.flair("s1", "t")
+  send_next(queue)
+
+  time.sleep(0.3)
+  send_next(queue)
+  send_next(queue)
+  assert reddit.sent == [("submission_reply", "s1"), ("flair", "s1")]
+  assert queue._next_ready() == (None, None)
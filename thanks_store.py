@@ -0,0 +1,154 @@
+import atexit, bisect, logging, sqlite3, threading, time
+from datetime import date
+
+logger = logging.getLogger(__name__)
+
+leaderboard_header = "This page is updated by a robot. Do not edit. *Last update*: {}\n\n"
+
+# thanks points per user, kept in SQLite with a sorted in-memory leaderboard
+#
+# a thanks updates one row and moves one entry in the ranking. The wiki page is
+# re-rendered from the ranking on a background thread, flush_delay seconds after
+# the last thanks and at most max_delay seconds after the first unsaved one.
+# Every (submission, thanker, thanked) is recorded too, so the once per thread
+# check doesn't have to load the whole thread
+class ThanksStore:
+  def __init__(self, path, subreddit, page_name, flush_delay=60, max_delay=300):
+    self.subreddit = subreddit
+    self.page_name = page_name
+    self.flush_delay = flush_delay
+    self.max_delay = max_delay
+    self.lock = threading.Lock()
+    self.wake = threading.Event()
+    # monotonic times of the first and latest thanks not yet on the wiki
+    self.dirty_since = None
+    self.changed_at = None
+
+    self.db = sqlite3.connect(path, check_same_thread=False)
+    self.db.execute("PRAGMA journal_mode=WAL")
+    self.db.execute("CREATE TABLE IF NOT EXISTS thanks (username TEXT PRIMARY KEY, display_name TEXT NOT NULL, points INTEGER NOT NULL, last_date TEXT NOT NULL)")
+    self.db.execute("CREATE TABLE IF NOT EXISTS thanked (submission_id TEXT NOT NULL, thanker TEXT NOT NULL, thanked TEXT NOT NULL, PRIMARY KEY (submission_id, thanker, thanked))")
+    self.db.commit()
+
+    # (submission ID, lowercase thanker, lowercase thanked) already registered
+    self.thanked = set(self.db.execute("SELECT submission_id, thanker, thanked FROM thanked"))
+    # lowercase username -> (display name, points, last star date)
+    self.users = {}
+    # (-points, last star date, lowercase username), best first
+    self.ranking = []
+    for username, display_name, points, last_date in self.db.execute("SELECT username, display_name, points, last_date FROM thanks"):
+      self.users[username] = (display_name, points, last_date)
+      self.ranking.append((-points, last_date, username))
+    self.ranking.sort()
+    logger.debug(f"Loaded {len(self.users)} users from the thanks store")
+
+    threading.Thread(target=self._run, name="thanks-flush", daemon=True).start()
+    atexit.register(self.flush)
+
+  # seed an empty store from the leaderboard markdown on the wiki
+  def import_leaderboard(self, markdown):
+    if self.users:
+      return
+    rows = markdown.strip().split("\n")[4:]
+    with self.lock:
+      for row in rows:
+        cells = [cell.strip() for cell in row.split("|")[1:-1]]
+        if len(cells) != 3:
+          continue
+        username, level, last_date = cells
+        points = get_level_num(level)
+        if points is None:
+          continue
+        self._set(username.removeprefix("u/"), points, last_date)
+      self.db.commit()
+    logger.info(f"Imported {len(self.users)} users from the thanks leaderboard")
+
+  def points(self, username):
+    user = self.users.get(username.lower())
+    return user[1] if user else 0
+
+  # whether thanker already thanked this user in the submission
+  def has_thanked(self, submission_id, thanker, thanked):
+    return (submission_id, thanker.lower(), thanked.lower()) in self.thanked
+
+  # record a thanks without adding a point, used by the backfill. Returns False if it was already recorded
+  def record_thanked(self, submission_id, thanker, thanked):
+    with self.lock:
+      added = self._record_thanked(submission_id, thanker, thanked)
+      self.db.commit()
+    return added
+
+  def _record_thanked(self, submission_id, thanker, thanked):
+    key = (submission_id, thanker.lower(), thanked.lower())
+    if key in self.thanked:
+      return False
+    self.thanked.add(key)
+    self.db.execute("INSERT OR IGNORE INTO thanked (submission_id, thanker, thanked) VALUES (?, ?, ?)", key)
+    return True
+
+  # add a point for username, returns their new total. The submission and thanker are recorded for has_thanked
+  def thank(self, username, submission_id=None, thanker=None):
+    with self.lock:
+      points = self.points(username) + 1
+      self._set(username, points, date.today().strftime("%Y-%m-%d"))
+      if submission_id and thanker:
+        self._record_thanked(submission_id, thanker, username)
+      self.db.commit()
+      now = time.monotonic()
+      if self.dirty_since is None:
+        self.dirty_since = now
+      self.changed_at = now
+    self.wake.set()
+    return points
+
+  def _set(self, username, points, last_date):
+    key = username.lower()
+    previous = self.users.get(key)
+    if previous:
+      del self.ranking[bisect.bisect_left(self.ranking, (-previous[1], previous[2], key))]
+    self.users[key] = (username, points, last_date)
+    bisect.insort(self.ranking, (-points, last_date, key))
+    self.db.execute("INSERT OR REPLACE INTO thanks (username, display_name, points, last_date) VALUES (?, ?, ?, ?)", (key, username, points, last_date))
+
+  def render(self):
+    with self.lock:
+      lines = [f"| u/{self.users[key][0]} | ★ {-points} | {last_date} |" for points, last_date, key in self.ranking]
+    return (leaderboard_header.format(date.today().strftime("%Y-%m-%d"))
+            + "| Username | Level | Last Star Date |\n|:---|:---|:---|\n" + "\n".join(lines))
+
+  # write the leaderboard to the wiki if anything changed since the last write
+  def flush(self):
+    with self.lock:
+      if self.dirty_since is None:
+        return
+      self.dirty_since = None
+    try:
+      self.subreddit.wiki[self.page_name].edit(content=self.render())
+      logger.info(f"Wrote {len(self.users)} users to the thanks leaderboard")
+    except Exception as e:
+      logger.error(f"Failed to write the thanks leaderboard: {e}")
+      # try again after another flush_delay
+      with self.lock:
+        now = time.monotonic()
+        self.dirty_since = self.dirty_since or now
+        self.changed_at = now
+
+  def _run(self):
+    while True:
+      with self.lock:
+        due = None if self.dirty_since is None else min(self.changed_at + self.flush_delay, self.dirty_since + self.max_delay)
+      if due is None:
+        self.wake.wait()
+        self.wake.clear()
+        continue
+      delay = due - time.monotonic()
+      if delay > 0:
+        self.wake.wait(delay)
+        self.wake.clear()
+        continue
+      self.flush()
+
+# the number of stars from a "★ 3" level cell
+def get_level_num(level):
+  level_num = level.split(" ")[-1]
+  return int(level_num) if level_num.isdigit() else None